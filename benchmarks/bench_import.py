@@ -0,0 +1,61 @@
+'''
+checks that importing tle2czml stays cheap, exits with an error when the import takes longer
+than the budget or loads one of the heavy modules that are only needed later on
+
+usage: python benchmarks/bench_import.py [budget_milliseconds] [repeats]
+'''
+
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+BUDGET_MILLISECONDS = 150
+# only imported once a conversion needs them
+DEFERRED_MODULES = ['pkg_resources', 'numpy', 'dateutil', 'pygeoif', 'pytz', 'tempfile',
+                    'concurrent.futures.process']
+
+# runs in a fresh interpreter, so nothing is imported already
+IMPORT_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+import tle2czml
+seconds = time.perf_counter() - start
+loaded = [name for name in {deferred!r}
+          if type(sys.modules.get(name)).__name__ == 'module']
+print(seconds, ','.join(loaded))
+'''
+
+
+def measure_import():
+    'returns the seconds importing tle2czml took and the deferred modules it loaded'
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(deferred=DEFERRED_MODULES)],
+        cwd=REPO_DIR, universal_newlines=True)
+    seconds, loaded = output.split()[0], output.split()[1:]
+    return float(seconds), loaded[0].split(',') if loaded else []
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MILLISECONDS
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    results = [measure_import() for _ in range(repeats)]
+    milliseconds = min(seconds for seconds, _ in results) * 1000
+    loaded = sorted(set(name for _, names in results for name in names))
+
+    print('import tle2czml: {:.1f} ms (budget {:.0f} ms)'.format(milliseconds, budget))
+    failed = False
+    if loaded:
+        print('loaded at import time: {}'.format(', '.join(loaded)))
+        failed = True
+    if milliseconds > budget:
+        print('over budget')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+'''
+times the conversion of synthetic catalogs end to end and stage by stage, with the peak
+memory and output size of the conversion, and compares two commits
+
+usage: python benchmarks/bench_pipeline.py [--sizes 1,100,10000,50000] [--windows 1h,24h,7d]
+                                           [--repeat N] [--json FILE]
+       python benchmarks/bench_pipeline.py --compare REV [REV] [--sizes ...] [--windows ...]
+
+the stages are read_tles, propagate (every satellite's positions), create_path, position
+(wrapping propagated positions in a Position), dumps (serializing the built document) and
+end_to_end (tles_to_czml), --compare checks the commits out in temporary git worktrees and
+runs this script against each of them, the second commit defaults to the working tree
+'''
+
+import argparse
+import contextlib
+import gc
+import inspect
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+START_TIME = datetime(2020, 10, 20, tzinfo=timezone.utc)
+SIZES = [1, 100, 10000, 50000]
+WINDOWS = {'1h': timedelta(hours=1), '24h': timedelta(hours=24), '7d': timedelta(days=7)}
+STAGES = ['read_tles', 'propagate', 'create_path', 'position', 'dumps', 'end_to_end']
+
+
+def run_case(tle2czml, number_of_satellites, window, repeat=1):
+    '''
+    returns the seconds of each stage for one catalog and window, the best of repeat runs,
+    with the peak traced memory and the bytes of the end to end conversion
+    '''
+    from catalog import synthetic_catalog
+
+    module = tle2czml.tle2czml
+    tles = synthetic_catalog(number_of_satellites)
+    start_time, end_time = START_TIME, START_TIME + WINDOWS[window]
+    timings = dict((stage, []) for stage in STAGES)
+    # older trees propagate inside create_position and have no positions argument
+    takes_positions = 'positions' in inspect.signature(module.create_position).parameters
+
+    for _ in range(repeat):
+        # otherwise every repeat after the first only times lookups in the warm tle cache
+        clear_tle_cache(module)
+        with timed(timings['read_tles']):
+            satellites = module.read_tles(tles, module.Colors())
+
+        with timed(timings['propagate']):
+            positions = [propagate(module, sat, start_time, end_time) for sat in satellites]
+
+        interval = module.get_interval(start_time, end_time)
+        with timed(timings['create_path']):
+            for sat in satellites:
+                module.create_path(interval, sat, start_time, end_time)
+
+        if takes_positions:
+            with timed(timings['position']):
+                for sat, sat_positions in zip(satellites, positions):
+                    module.create_position(start_time, end_time, sat, sat_positions)
+
+        doc = build_document(module, satellites, positions, start_time, end_time,
+                             takes_positions)
+        with timed(timings['dumps']):
+            czml = str(doc)
+        del doc, czml, positions
+
+        clear_tle_cache(module)
+        with timed(timings['end_to_end']):
+            output = convert(module, tles, start_time, end_time)
+
+    clear_tle_cache(module)
+    gc.collect()
+    tracemalloc.start()
+    output = convert(module, tles, start_time, end_time)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {'satellites': number_of_satellites, 'window': window,
+              'peak_bytes': peak, 'output_bytes': len(output.encode('utf-8'))}
+    for stage, seconds in timings.items():
+        result[stage] = min(seconds) if seconds else None
+    return result
+
+
+@contextlib.contextmanager
+def timed(timings):
+    'appends the seconds the block took to timings'
+    start = time.perf_counter()
+    yield
+    timings.append(time.perf_counter() - start)
+
+
+def clear_tle_cache(module):
+    'empties the cache of parsed TLEs of trees that have one, so parsing is timed from scratch'
+    tle_cache = getattr(module, 'tle_cache', None)
+    if tle_cache is not None:
+        tle_cache.clear()
+
+
+def propagate(module, sat, start_time, end_time):
+    'returns the positions of a satellite the way the tree propagates them by default'
+    if hasattr(module, 'get_positions'):
+        return module.get_positions(sat, start_time, end_time)
+    number_of_positions = int((end_time - start_time).total_seconds() / 300) + 5
+    return module.get_future_sat_positions(sat.tle_object, number_of_positions, start_time)
+
+
+def build_document(module, satellites, positions, start_time, end_time, takes_positions):
+    'returns the CZML document of the satellites, reusing their positions when the tree can'
+    with contextlib.redirect_stdout(io.StringIO()):
+        doc = module.create_czml_file(start_time, end_time)
+    for sat, sat_positions in zip(satellites, positions):
+        if takes_positions:
+            packet = module.create_satellite_packet(sat, start_time, end_time, sat_positions)
+        else:
+            packet = module.create_satellite_packet(sat, start_time, end_time)
+        doc.packets.append(packet)
+    return doc
+
+
+def convert(module, tles, start_time, end_time):
+    'converts the catalog with tles_to_czml, hiding what older trees print'
+    with contextlib.redirect_stdout(io.StringIO()):
+        return module.tles_to_czml(tles, start_time=start_time, end_time=end_time, silent=True)
+
+
+def run(sizes, windows, repeat, source=REPO_DIR):
+    'yields the result of every case, importing tle2czml from the source directory'
+    sys.path.insert(0, BENCHMARK_DIR)
+    sys.path.insert(0, source)
+    import tle2czml
+    import tle2czml.tle2czml  # noqa: F401
+
+    for number_of_satellites in sizes:
+        for window in windows:
+            yield run_case(tle2czml, number_of_satellites, window, repeat)
+
+
+def compare(revisions, sizes, windows, repeat):
+    'runs the benchmarks against each revision, returns their results by revision'
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='tle2czml-bench-')
+    try:
+        for revision in revisions:
+            source = REPO_DIR
+            if revision is not None:
+                source = os.path.join(work_dir, 'tree-{}'.format(len(results)))
+                subprocess.check_call(['git', 'worktree', 'add', '--detach', '--quiet', source,
+                                       revision], cwd=REPO_DIR)
+            output_path = os.path.join(work_dir, 'results-{}.json'.format(len(results)))
+            try:
+                # a fresh interpreter per tree, so nothing is imported from the other one
+                subprocess.check_call([
+                    sys.executable, os.path.abspath(__file__), '--source', source,
+                    '--sizes', ','.join(map(str, sizes)), '--windows', ','.join(windows),
+                    '--repeat', str(repeat), '--json', output_path, '--quiet'])
+            finally:
+                if revision is not None:
+                    subprocess.check_call(['git', 'worktree', 'remove', '--force', source],
+                                          cwd=REPO_DIR)
+            with open(output_path) as results_file:
+                results[revision or 'working tree'] = json.load(results_file)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_results(results, header=True):
+    'prints a table of the results of one tree'
+    if header:
+        print('{:>10} {:>6} {:>11} {:>10} {:>12} {:>10} {:>10} {:>11} {:>10} {:>13}'.format(
+            'satellites', 'window', 'read_tles', 'propagate', 'create_path', 'position',
+            'dumps', 'end_to_end', 'peak MB', 'output bytes'))
+    for result in results:
+        print('{:>10} {:>6} {} {:>10.1f} {:>13}'.format(
+            result['satellites'], result['window'],
+            ' '.join(format_seconds(result[stage], width)
+                     for stage, width in zip(STAGES, (11, 10, 12, 10, 10, 11))),
+            result['peak_bytes'] / 1e6, result['output_bytes']))
+
+
+def print_comparison(results):
+    'prints how the second tree compares to the first, as ratios of seconds, memory and size'
+    (old_name, old_results), (new_name, new_results) = results.items()
+    print('{} / {}'.format(new_name, old_name))
+    print('{:>10} {:>6} {:>11} {:>10} {:>12} {:>10} {:>10} {:>11} {:>10} {:>13}'.format(
+        'satellites', 'window', 'read_tles', 'propagate', 'create_path', 'position', 'dumps',
+        'end_to_end', 'peak', 'output'))
+    for old, new in zip(old_results, new_results):
+        ratios = [format_ratio(old[stage], new[stage], width)
+                  for stage, width in zip(STAGES, (11, 10, 12, 10, 10, 11))]
+        print('{:>10} {:>6} {} {} {}'.format(
+            old['satellites'], old['window'], ' '.join(ratios),
+            format_ratio(old['peak_bytes'], new['peak_bytes'], 10),
+            format_ratio(old['output_bytes'], new['output_bytes'], 13)))
+
+
+def format_seconds(seconds, width):
+    if seconds is None:
+        return '-'.rjust(width)
+    return '{:.4f}'.format(seconds).rjust(width)
+
+
+def format_ratio(old, new, width):
+    if old is None or new is None or not old:
+        return '-'.rjust(width)
+    return '{:.2f}x'.format(new / old).rjust(width)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                            help='comma separated numbers of satellites')
+    arg_parser.add_argument('--windows', default=','.join(WINDOWS),
+                            help='comma separated windows, of {}'.format(', '.join(WINDOWS)))
+    arg_parser.add_argument('--repeat', type=int, default=1,
+                            help='runs of every case, the fastest is reported')
+    arg_parser.add_argument('--json', help='also writes the results to this file')
+    arg_parser.add_argument('--compare', nargs='+', metavar='REV',
+                            help='commits to compare, the second defaults to the working tree')
+    arg_parser.add_argument('--source', default=REPO_DIR, help=argparse.SUPPRESS)
+    arg_parser.add_argument('--quiet', action='store_true', help=argparse.SUPPRESS)
+    options = arg_parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    windows = options.windows.split(',')
+    for window in windows:
+        if window not in WINDOWS:
+            arg_parser.error('unknown window {}'.format(window))
+
+    if options.compare:
+        revisions = options.compare[:2]
+        if len(revisions) == 1:
+            revisions.append(None)
+        results = compare(revisions, sizes, windows, options.repeat)
+        for name, tree_results in results.items():
+            print(name)
+            print_results(tree_results)
+            print()
+        print_comparison(results)
+        if options.json:
+            with open(options.json, 'w') as results_file:
+                json.dump(results, results_file, indent=2)
+        return
+
+    results = []
+    for result in run(sizes, windows, options.repeat, options.source):
+        results.append(result)
+        if not options.quiet:
+            print_results([result], header=len(results) == 1)
+
+    if options.json:
+        with open(options.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
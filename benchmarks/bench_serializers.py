@@ -0,0 +1,55 @@
+'''
+compares the time the JSON backends take to serialize the same CZML document
+
+usage: python benchmarks/bench_serializers.py [number_of_satellites] [repeats]
+'''
+
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tle2czml import czml  # noqa: E402
+from tle2czml.tle2czml import (Colors, create_czml_file,  # noqa: E402
+                               create_satellite_packets, iter_tles)
+
+from catalog import synthetic_catalog  # noqa: E402
+
+START_TIME = datetime(2020, 10, 20, tzinfo=timezone.utc)
+END_TIME = START_TIME + timedelta(hours=24)
+
+
+def build_document(number_of_satellites):
+    'returns a fully built CZML document for a synthetic catalog'
+    doc = create_czml_file(START_TIME, END_TIME)
+    satellites = iter_tles(synthetic_catalog(number_of_satellites).splitlines(), Colors())
+    for packet in create_satellite_packets(satellites, START_TIME, END_TIME):
+        doc.packets.append(packet)
+    return doc
+
+
+def main():
+    number_of_satellites = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    doc = build_document(number_of_satellites)
+
+    print('{:<8} {:<10} {:<8} {:>10} {:>12}'.format(
+        'backend', 'precision', 'compact', 'seconds', 'bytes'))
+    for backend in czml.JSON_BACKENDS:
+        for precision, compact in ((None, False), (None, True), (3, True)):
+            try:
+                serializer = czml.set_serializer(backend, precision, compact)
+            except ImportError:
+                continue
+            if serializer.compact != compact:
+                continue
+            seconds = min(timeit.repeat(doc.dumps, number=1, repeat=repeats))
+            print('{:<8} {:<10} {:<8} {:>10.4f} {:>12}'.format(
+                backend, str(precision), str(compact), seconds, len(doc.dumps())))
+    czml.set_serializer()
+
+
+if __name__ == '__main__':
+    main()
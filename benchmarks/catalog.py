@@ -0,0 +1,44 @@
+''' builds synthetic TLE catalogs for the benchmarks '''
+
+# (mean motion in revs per day, eccentricity, inclination) of the orbits the catalog cycles through
+ORBITS = [
+    (15.49312821, 0.0001350, 51.6436),  # LEO, like the ISS
+    (14.19540000, 0.0011000, 98.2000),  # sun synchronous LEO
+    (2.00563000, 0.0050000, 55.0000),   # MEO, like GPS
+    (1.00270000, 0.0002000, 0.0500),    # GEO
+    (2.00600000, 0.7200000, 63.4000),   # Molniya
+]
+
+
+def checksum(line):
+    'returns the TLE checksum of the first 68 characters of a line'
+    total = 0
+    for char in line[:68]:
+        if char.isdigit():
+            total += int(char)
+        elif char == '-':
+            total += 1
+    return str(total % 10)
+
+
+def synthetic_tle(index):
+    'returns the three lines of the index-th satellite of the catalog'
+    mean_motion, eccentricity, inclination = ORBITS[index % len(ORBITS)]
+    satnum = 10000 + index
+    raan = (index * 7.31) % 360
+    mean_anomaly = (index * 13.17) % 360
+
+    line1 = '1 {:05d}U 98067A   20293.22611972  .00000497  00000-0  17003-4 0  999'.format(satnum)
+    line2 = '2 {:05d} {:8.4f} {:8.4f} {:07d} {:8.4f} {:8.4f} {:11.8f}{:5d}'.format(
+        satnum, inclination, raan, int(round(eccentricity * 1e7)), 46.8729, mean_anomaly,
+        mean_motion, 25124)
+
+    return ['SAT {}'.format(index), line1 + checksum(line1), line2 + checksum(line2)]
+
+
+def synthetic_catalog(number_of_satellites):
+    'returns the text of a TLE file with number_of_satellites satellites'
+    lines = []
+    for index in range(number_of_satellites):
+        lines.extend(synthetic_tle(index))
+    return '\n'.join(lines) + '\n'
@@ -14,6 +14,7 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/kujosHeist/tle2czml',
     packages=['tle2czml'],
+    python_requires='>=3.9',
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -22,11 +23,16 @@ setuptools.setup(
     install_requires=[
         'pygeoif>=0.7',
         'python-dateutil>=2.6.1',
-        'pytz>=2018.3',
         'sgp4>=1.4',
         'six>=1.11.0',
         'wheel>=0.24.0',
     ],
+    extras_require={
+        'fast': ['numpy>=1.16', 'sgp4>=2.0'],
+    },
+    entry_points={
+        'console_scripts': ['tle2czml-serve=tle2czml.serve:main'],
+    },
     include_package_data=True,
     zip_safe=False
 )
@@ -1,5 +1,11 @@
 ''' defines what gets brought into the namespace with the import statement '''
 
+from .cache import EphemerisCache
 from .czml import (CZML, Billboard, CZMLPacket, Description, Label, Path,
                    Position)
-from .tle2czml import create_czml, tles_to_czml
+from .ephemeris import (Ephemeris, create_ephemeris, ephemeris_to_czml, load_ephemeris,
+                        write_ephemeris)
+from .incremental import IncrementalConverter
+from .live import iter_czml_chunks
+from .stats import ConversionStats
+from .tle2czml import create_czml, iter_tles, tle_cache, tles_to_czml, write_czml
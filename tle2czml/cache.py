@@ -0,0 +1,210 @@
+''' on-disk cache of propagated satellite positions '''
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from sgp4.earth_gravity import wgs72
+from sgp4.io import twoline2rv
+
+from .lazy import lazy_import
+
+# numpy is only loaded once positions are propagated or an EphemerisCache is used
+np = lazy_import('numpy')
+
+try:
+    from sgp4.api import WGS72, Satrec, SatrecArray, jday
+except ImportError:
+    WGS72 = Satrec = SatrecArray = jday = None
+if np is None:
+    # the batch propagation engine needs numpy and sgp4>=2.0,
+    # without them Satrec is None and the legacy propagator is used
+    Satrec = None
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+CACHE_FILE_EXTENSION = '.npy'
+DEFAULT_TLE_CACHE_SIZE = 2000
+
+
+class TLECache:
+    '''
+    Bounded in-memory LRU cache of the sgp4 objects initialized from pairs of TLE lines,
+    so that converting the same catalog again skips SGP4 initialization, maxsize can be
+    changed at any time
+    '''
+
+    def __init__(self, maxsize=DEFAULT_TLE_CACHE_SIZE):
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+
+    @property
+    def maxsize(self):
+        'the most entries kept, 0 disables the cache'
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize):
+        with self._lock:
+            self._maxsize = maxsize
+            self._trim()
+
+    def get(self, line1, line2):
+        '''
+        returns the legacy sgp4 object and the Satrec of a pair of TLE lines, with numpy and
+        sgp4>=2.0 the legacy object is None, and without them the Satrec is None
+        '''
+        key = (line1.rstrip(), line2.rstrip())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if Satrec is not None:
+            # the legacy sgp4 object is only needed by the legacy propagator
+            entry = (None, Satrec.twoline2rv(key[0], key[1], WGS72))
+        else:
+            entry = (twoline2rv(key[0], key[1], wgs72), None)
+
+        with self._lock:
+            self.misses += 1
+            if self._maxsize:
+                self._entries[key] = entry
+                self._trim()
+        return entry
+
+    def clear(self):
+        'removes every entry and resets the hit and miss counters'
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        'returns the hit and miss counters and the number of entries'
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _trim(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+
+class EphemerisCache:
+    '''
+    Content addressed cache of propagated positions, keyed by a hash of the TLE lines, start time,
+    end time and time step, each entry is a .npy file of the flat [t, x, y, z, ...] positions,
+    the least recently used entries are removed once the files take up more than max_bytes
+    '''
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        if np is None:
+            raise ImportError('EphemerisCache needs numpy')
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    @staticmethod
+    def get_key(raw_tle, start_time, end_time, time_step):
+        'returns the cache key for the positions of a tle over a time window'
+        key = '\n'.join([raw_tle[1].strip(), raw_tle[2].strip(), start_time.isoformat(),
+                         end_time.isoformat(), repr(float(time_step))])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        'returns the cached positions for key, or None if they are not cached'
+        path = self._get_path(key)
+        try:
+            positions = np.load(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # the modification time orders the entries for eviction
+        os.utime(path)
+        self.hits += 1
+        return positions
+
+    def put(self, key, positions):
+        'caches the positions for key'
+        positions = np.asarray(positions, dtype=np.float64)
+
+        import tempfile  # only needed once something is cached
+
+        # written to a temporary file first so that readers never see a partial entry
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as file:
+            np.save(file, positions)
+        os.replace(temp_path, self._get_path(key))
+
+        if self._size is None:
+            self._size = self._get_size()
+        else:
+            self._size += positions.nbytes
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        'removes the least recently used entries until the cache fits in max_bytes'
+        entries = []
+        for entry in self._get_entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size = sum(entry_size for _, entry_size, _ in entries)
+
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+
+        self._size = size
+
+    def clear(self):
+        'removes every entry and resets the hit and miss counters'
+        for entry in self._get_entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        'returns the hit and miss counters, counts from worker processes are not included'
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + CACHE_FILE_EXTENSION)
+
+    def _get_entries(self):
+        return [entry for entry in os.scandir(self.directory)
+                if entry.name.endswith(CACHE_FILE_EXTENSION)]
+
+    def _get_size(self):
+        size = 0
+        for entry in self._get_entries():
+            try:
+                size += entry.stat().st_size
+            except OSError:
+                pass
+        return size
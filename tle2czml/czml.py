@@ -30,13 +30,19 @@ try:
     import simplejson as json
 except ImportError:
     import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
+from array import array
 from datetime import date, datetime
+from functools import lru_cache
 
-import dateutil.parser
-from pygeoif import geometry
-from pygeoif.geometry import as_shape as asShape
-from pytz import utc
 
 try:
     long
@@ -51,9 +57,110 @@ except NameError:
     basestring = unicode = str
 
 # XXX Import the geometries from shapely if it is installed
-# or otherwise from Pygeoif
+# or otherwise from Pygeoif, only when geometries are used
+
+
+def asShape(geom):
+    from pygeoif.geometry import as_shape
+    return as_shape(geom)
+
+
+def _geometry():
+    from pygeoif import geometry
+    return geometry
+
+
+JSON_BACKENDS = ('json', 'orjson', 'ujson')
+DATETIME_CACHE_SIZE = 256
+
+
+class JSONSerializer(object):
+    """ Turns CZML data into JSON text with one of the JSON backends:
+    'json' (simplejson or the standard library json), 'orjson' or 'ujson'.
+    'auto' picks the fastest one that is installed.
+
+    Floats are rounded to precision decimal places if it is given, and
+    compact leaves out the whitespace after separators. orjson and ujson
+    always write compact JSON. Flat float buffers (numpy arrays and
+    array('d')) are serialized directly, orjson does so natively for numpy.
+    """
+
+    def __init__(self, backend='json', precision=None, compact=False):
+        if backend == 'auto':
+            if orjson is not None:
+                backend = 'orjson'
+            elif ujson is not None:
+                backend = 'ujson'
+            else:
+                backend = 'json'
+        if backend not in JSON_BACKENDS:
+            raise ValueError('Unknown JSON backend %s' % backend)
+        if ((backend == 'orjson' and orjson is None) or
+                (backend == 'ujson' and ujson is None)):
+            raise ImportError('JSON backend %s is not installed' % backend)
 
+        self.backend = backend
+        self.precision = precision
+        self.compact = compact or backend != 'json'
 
+    @property
+    def item_separator(self):
+        """ The separator written between the items of an array """
+        if self.compact:
+            return ','
+        return ', '
+
+    def dumps(self, data):
+        if self.precision is not None:
+            data = _round_floats(data, self.precision)
+        if self.backend == 'orjson':
+            return orjson.dumps(data, default=_buffer_to_list,
+                                option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+        elif self.backend == 'ujson':
+            # ujson writes / as \/ unless told not to, unlike json and orjson
+            return ujson.dumps(data, default=_buffer_to_list, escape_forward_slashes=False)
+        elif self.compact:
+            return json.dumps(data, default=_buffer_to_list, separators=(',', ':'))
+        return json.dumps(data, default=_buffer_to_list)
+
+
+def _buffer_to_list(obj):
+    if isinstance(obj, array) or hasattr(obj, 'dtype'):
+        return obj.tolist()
+    raise TypeError('%s is not JSON serializable' % obj.__class__.__name__)
+
+
+def _round_floats(data, precision):
+    if isinstance(data, float):
+        return round(data, precision)
+    elif isinstance(data, dict):
+        return dict((k, _round_floats(v, precision)) for k, v in data.items())
+    elif isinstance(data, (list, tuple)):
+        return [_round_floats(v, precision) for v in data]
+    elif isinstance(data, array):
+        return [round(v, precision) for v in data]
+    elif hasattr(data, 'dtype') and data.dtype.kind == 'f':
+        return data.round(precision)
+    return data
+
+
+_serializer = JSONSerializer()
+
+
+def get_serializer():
+    """ Returns the JSONSerializer used to serialize all CZML objects """
+    return _serializer
+
+
+def set_serializer(backend='json', precision=None, compact=False):
+    """ Sets the JSON backend and options used to serialize all CZML
+    objects, backend can also be a JSONSerializer. """
+    global _serializer
+    if isinstance(backend, JSONSerializer):
+        _serializer = backend
+    else:
+        _serializer = JSONSerializer(backend, precision, compact)
+    return _serializer
 
 
 def grouper(iterable, n, fillvalue=None):
@@ -61,6 +168,18 @@ def grouper(iterable, n, fillvalue=None):
     return izip_longest(*args, fillvalue=fillvalue)
 
 
+def coordinates(geom):
+    """Returns the coordinate container for geom, flat float buffers,
+    i.e. array('d') or numpy arrays, are kept as they are instead of being
+    split into a _Coordinate per point.
+    """
+    if isinstance(geom, (_Coordinates, _FlatCoordinates)):
+        return geom
+    elif isinstance(geom, array) or hasattr(geom, 'dtype'):
+        return _FlatCoordinates(geom)
+    return _Coordinates(geom)
+
+
 def class_property(cls, name, doc=None):
     """Returns a property function that checks to be sure
     the value being assigned is a certain class before assigning it to a hidden
@@ -94,6 +213,21 @@ def class_property(cls, name, doc=None):
     return property(getter, setter, doc=doc)
 
 
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def _parse_datetime(dt):
+    # every packet of a conversion sets the same few epochs,
+    # dateutil is only imported once a string has to be parsed
+    import dateutil.parser
+    return dateutil.parser.parse(dt)
+
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def _format_datetime(dt, utcoffset):
+    # equal aware datetimes in different timezones format differently,
+    # so the offset is part of the key
+    return dt.isoformat()
+
+
 def datetime_property(name, allow_offset=False, doc=None):
     """Generates a datetime property that handles strings and timezones.
     """
@@ -101,7 +235,9 @@ def datetime_property(name, allow_offset=False, doc=None):
 
     def getter(self):
         val = getattr(self, reserved_name)
-        if isinstance(val, (date, datetime)):
+        if isinstance(val, datetime):
+            return _format_datetime(val, val.utcoffset())
+        elif isinstance(val, date):
             return val.isoformat()
         elif allow_offset and isinstance(val, (int, long, float)):
             return val
@@ -118,9 +254,9 @@ def datetime_property(name, allow_offset=False, doc=None):
                 try:
                     dt = float(dt)
                 except ValueError:
-                    dt = dateutil.parser.parse(dt)
+                    dt = _parse_datetime(dt)
             else:
-                dt = dateutil.parser.parse(dt)
+                dt = _parse_datetime(dt)
             setattr(self, reserved_name, dt)
         else:
             raise ValueError
@@ -136,7 +272,7 @@ class _CZMLBaseObject(object):
     _properties = ()
 
     def __str__(self):
-        return json.dumps(list(self.data()))
+        return _serializer.dumps(list(self.data()))
 
     def __init__(self, **kwargs):
         """Default init functionality is to load kwargs
@@ -149,7 +285,7 @@ class _CZMLBaseObject(object):
 
     def dumps(self):
         d = self.data()
-        return json.dumps(d)
+        return _serializer.dumps(d)
 
     def data(self):
         d = {}
@@ -157,8 +293,8 @@ class _CZMLBaseObject(object):
             a = getattr(self, attr)
             if a is not None:
                 # These classes have a data method that should be called.
-                if isinstance(a, (_CZMLBaseObject, _Colors,
-                                  _Coordinates, _Positions)):
+                if isinstance(a, (_CZMLBaseObject, _Colors, _Coordinates,
+                                  _FlatCoordinates, _Positions)):
                     d[attr] = a.data()
                 else:
                     d[attr] = a
@@ -197,13 +333,35 @@ class CZML(_CZMLBaseObject):
         else:
             self.packets = []
 
+    def __str__(self):
+        return self.dumps()
+
     def data(self):
         for p in self.packets:
             yield p.data()
 
     def dumps(self):
-        d = list(self.data())
-        return json.dumps(d)
+        separator = _serializer.item_separator
+        return '[' + separator.join(self.iterdumps()) + ']'
+
+    def iterdumps(self):
+        """ Serializes the packets one at a time, so that already
+        serialized packets can be spliced in as they are. """
+        for p in self.packets:
+            yield p.dumps()
+
+    def dump(self, fp):
+        """ Writes the document to the file object fp one packet at a time.
+        packets may be any iterable, e.g. a generator creating the packets
+        as they are written, so the whole document is never held in memory.
+        """
+        separator = _serializer.item_separator
+        fp.write('[')
+        for i, packet_json in enumerate(self.iterdumps()):
+            if i:
+                fp.write(separator)
+            fp.write(packet_json)
+        fp.write(']')
 
     def load(self, data):
         self.packets = []
@@ -215,11 +373,28 @@ class CZML(_CZMLBaseObject):
     def append(self, packet):
         if self.packets is None:
             self.packets = []
-        if isinstance(packet, CZMLPacket):
+        if isinstance(packet, (CZMLPacket, SerializedPacket)):
             self.packets.append(packet)
         else:
             raise ValueError
 
+
+class SerializedPacket(object):
+    """ A CZML packet that has already been serialized to JSON, e.g. in
+    another process, it is written out as it is. """
+
+    def __init__(self, packet_json):
+        self.packet_json = packet_json
+
+    def __str__(self):
+        return self.packet_json
+
+    def data(self):
+        return json.loads(self.packet_json)
+
+    def dumps(self):
+        return self.packet_json
+
 class _DateTimeAware(_CZMLBaseObject):
     """ A baseclass for Date time aware objects """
 
@@ -264,7 +439,7 @@ class _Coordinate(object):
             try:
                 self.t = float(t)
             except ValueError:
-                self.t = dateutil.parser.parse(t)
+                self.t = _parse_datetime(t)
         else:
             raise ValueError
 
@@ -292,11 +467,11 @@ class _Coordinates(object):
                 self.coords = []
                 for coord in grouper(coords, 2):
                     geom = asShape(coord[1])
-                    assert(isinstance(geom, geometry.Point))
+                    assert(isinstance(geom, _geometry().Point))
                     self.coords.append(_Coordinate(*geom.coords[0], t=coord[0]))
         else:
             geom = asShape(coords)
-            if isinstance(geom, geometry.Point):
+            if isinstance(geom, _geometry().Point):
                 self.coords = [_Coordinate(*geom.coords[0])]
 
     def data(self):
@@ -315,6 +490,23 @@ class _Coordinates(object):
         return d
 
 
+class _FlatCoordinates(object):
+    """ A constant [X, Y, Z] or time-tagged [Time, X, Y, Z, Time, X, Y, Z, ...]
+    position held in a flat buffer of floats, where Time is in seconds since
+    epoch. The buffer itself is handed to the JSONSerializer.
+    """
+
+    coords = None
+
+    def __init__(self, coords):
+        if len(coords) != 3 and len(coords) % 4 != 0:
+            raise ValueError
+        self.coords = coords
+
+    def data(self):
+        return self.coords
+
+
 class Number(_DateTimeAware):
     """Represents numbers"""
     number = None
@@ -374,7 +566,7 @@ class Position(_DateTimeAware):
     @cartesian.setter
     def cartesian(self, geom):
         if geom is not None:
-            self._cartesian = _Coordinates(geom)
+            self._cartesian = coordinates(geom)
         else:
             self._cartesian = None
 
@@ -393,7 +585,7 @@ class Position(_DateTimeAware):
     @cartographicDegrees.setter
     def cartographicDegrees(self, geom):
         if geom is not None:
-            self._cartographicDegrees = _Coordinates(geom)
+            self._cartographicDegrees = coordinates(geom)
         else:
             self._cartographicDegrees = None
 
@@ -413,7 +605,7 @@ class Position(_DateTimeAware):
     @cartographicRadians.setter
     def cartographicRadians(self, geom):
         if geom is not None:
-            self._cartographicRadians = _Coordinates(geom)
+            self._cartographicRadians = coordinates(geom)
         else:
             self._cartographicRadians = None
 
@@ -480,7 +672,7 @@ class _Color(object):
             try:
                 self.t = float(t)
             except ValueError:
-                self.t = dateutil.parser.parse(t)
+                self.t = _parse_datetime(t)
         else:
             raise ValueError
 
@@ -626,7 +818,7 @@ class Scale(_DateTimeAware):
                         try:
                             t = float(t)
                         except ValueError:
-                            t = dateutil.parser.parse(t)
+                            t = _parse_datetime(t)
                     else:
                         raise ValueError
                     self._number.append((t, v))
@@ -695,9 +887,9 @@ class _Positions(object):
             self.coords = coords
         else:
             geom = asShape(coords)
-            if isinstance(geom, geometry.Polygon):
+            if isinstance(geom, _geometry().Polygon):
                 geom = geom.exterior
-            if isinstance(geom, (geometry.LineString, geometry.LinearRing)):
+            if isinstance(geom, (_geometry().LineString, _geometry().LinearRing)):
                 self.coords = []
                 for coord in geom.coords:
                     if len(coord) == 2:
@@ -0,0 +1,213 @@
+''' binary ephemeris files of propagated positions, to memory map or turn into czml '''
+
+import json
+import numbers
+import struct
+from datetime import datetime
+from itertools import chain
+
+from .frames import INERTIAL
+from .lazy import lazy_import
+from .stats import MeasuredWriter, measure, measure_iterable
+from .tle2czml import (CATALOG_CHUNK_SIZE, TIME_STEP, Colors, Satrec, create_czml_file,
+                       create_satellite, create_satellite_packet, get_positions,
+                       get_time_context, get_time_window, iter_tles, propagate_catalog)
+
+# numpy is only loaded once an ephemeris is written or read
+np = lazy_import('numpy')
+
+# a file is the magic, the length of the JSON header as a little endian uint32, the header
+# padded with spaces so the positions start on a HEADER_ALIGNMENT boundary and then the
+# positions, a C ordered [satellites, samples, 3] array of x, y, z in metres
+MAGIC = b'TLE2CZML'
+FORMAT_VERSION = 1
+HEADER_ALIGNMENT = 64
+DTYPES = ('float32', 'float64')
+
+
+class Ephemeris:
+    '''
+    The positions of an ephemeris file, see write_ephemeris, positions is a read only memory
+    mapped [satellites, samples, 3] array of TEME x, y, z in metres, sample i of every
+    satellite is i * time_step seconds after start_time, satellites are dicts of the name,
+    norad_id, tle lines and rgba color of each satellite in the same order as the positions
+    '''
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('Ephemeris needs numpy')
+
+        header, offset = read_header(path)
+        self.path = path
+        self.header = header
+        self.start_time = datetime.fromisoformat(header['start_time'])
+        self.end_time = datetime.fromisoformat(header['end_time'])
+        self.time_step = header['time_step']
+        self.satellites = header['satellites']
+
+        shape = tuple(header['shape'])
+        if shape[0]:
+            self.positions = np.memmap(path, dtype=np.dtype(header['dtype']), mode='r',
+                                       offset=offset, shape=shape)
+        else:
+            # an empty file cannot be memory mapped
+            self.positions = np.empty(shape, dtype=np.dtype(header['dtype']))
+
+    def get_times(self):
+        'returns the seconds since start_time of the samples'
+        return np.arange(self.positions.shape[1], dtype=np.float64) * self.time_step
+
+    def get_positions(self, index):
+        'returns the positions of a satellite as a flat float64 [t, x, y, z, ...] array'
+        positions = np.empty((self.positions.shape[1], 4), dtype=np.float64)
+        positions[:, 0] = self.get_times()
+        positions[:, 1:] = self.positions[index]
+        return positions.ravel()
+
+    def __len__(self):
+        return len(self.satellites)
+
+    def __repr__(self):
+        return 'Ephemeris({!r}, {} satellites, {} samples)'.format(
+            self.path, len(self), self.positions.shape[1])
+
+
+def load_ephemeris(path):
+    'returns the Ephemeris of the file at path, its positions are memory mapped'
+    return Ephemeris(path)
+
+
+def read_header(path):
+    'returns the JSON header of an ephemeris file and the offset of its positions'
+    with open(path, 'rb') as file:
+        prefix = file.read(len(MAGIC) + 4)
+        if len(prefix) < len(MAGIC) + 4 or not prefix.startswith(MAGIC):
+            raise ValueError('{} is not an ephemeris file'.format(path))
+        header_length, = struct.unpack('<I', prefix[len(MAGIC):])
+        header = json.loads(file.read(header_length).decode('utf-8'))
+
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError('unsupported ephemeris version {!r}'.format(header.get('version')))
+    return header, len(prefix) + header_length
+
+
+def write_ephemeris(file, tles, start_time=None, end_time=None, time_step=TIME_STEP,
+                    dtype='float32', chunk_size=CATALOG_CHUNK_SIZE, colors=None, cache=None,
+                    stats=None):
+    '''
+    Propagates the contents of a TLE file and writes the positions to the binary file object,
+    tles can be the contents as a string, an open TLE file or any iterable of lines, all
+    satellites are sampled every time_step seconds, which has to be a number, dtype 'float32'
+    halves the size and keeps positions to within half a metre in low earth orbit and about
+    2 metres at geostationary distance, 'float64' keeps them exactly as tles_to_czml writes them,
+    the positions are written chunk_size satellites at a time, see propagate_catalog,
+    colors and cache are used as by tles_to_czml, the time taken by each stage is recorded in
+    stats if a ConversionStats is given
+    '''
+    if np is None:
+        raise ImportError('write_ephemeris needs numpy')
+    if dtype not in DTYPES:
+        raise ValueError('unknown dtype {!r}, use one of {}'.format(dtype, DTYPES))
+    time_step = check_time_step(time_step)
+    if isinstance(tles, str):
+        tles = tles.splitlines()
+
+    start_time, end_time = get_time_window(start_time, end_time)
+    # the header needs the number of satellites before the first position is written
+    satellites = list(measure_iterable(iter_tles(tles, Colors(colors)), stats, 'parse'))
+    number_of_positions = get_time_context(start_time, end_time).get_number_of_positions(
+        time_step)
+
+    header = {
+        'version': FORMAT_VERSION,
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'time_step': time_step,
+        'dtype': dtype,
+        'shape': [len(satellites), number_of_positions, 3],
+        'satellites': [{'name': sat.sat_name, 'norad_id': sat.elements.satnum,
+                        'tle': sat.raw_tle, 'rgba': list(sat.rgba)} for sat in satellites],
+    }
+    header_json = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    padding = -(len(MAGIC) + 4 + len(header_json)) % HEADER_ALIGNMENT
+    header_json += b' ' * padding
+
+    if stats is not None:
+        file = MeasuredWriter(file, stats)
+    file.write(MAGIC + struct.pack('<I', len(header_json)) + header_json)
+
+    if Satrec is not None:
+        propagated = propagate_catalog(satellites, start_time, end_time, chunk_size,
+                                       time_step, cache, stats)
+    else:
+        propagated = ((sat, _get_positions(sat, start_time, end_time, time_step, cache, stats))
+                      for sat in satellites)
+
+    for _, positions in propagated:
+        xyz = np.asarray(positions, dtype=np.float64).reshape(-1, 4)[:, 1:]
+        file.write(xyz.astype(dtype).tobytes())
+
+
+def _get_positions(sat, start_time, end_time, time_step, cache, stats):
+    with measure(stats, 'propagate'):
+        return get_positions(sat, start_time, end_time, time_step, cache)
+
+
+def check_time_step(time_step):
+    '''
+    returns time_step as an int or float, raises a ValueError unless it is a positive number,
+    all satellites of an ephemeris file share one time step
+    '''
+    if (isinstance(time_step, bool) or not isinstance(time_step, numbers.Real) or
+            time_step <= 0):
+        raise ValueError('an ephemeris needs one time_step in seconds for all satellites, '
+                         'not {!r}'.format(time_step))
+    if isinstance(time_step, numbers.Integral):
+        return int(time_step)
+    return float(time_step)
+
+
+def create_ephemeris(inputfile_path, outputfile_path=None, start_time=None, end_time=None,
+                     time_step=TIME_STEP, dtype='float32', chunk_size=CATALOG_CHUNK_SIZE,
+                     colors=None, cache=None, stats=None):
+    """
+    Takes in a file of TLE's and writes the propagated positions to a binary ephemeris file,
+    see write_ephemeris for the options.
+    """
+    # checked before the output file is created
+    time_step = check_time_step(time_step)
+    with open(inputfile_path, 'r') as tle_src:
+        if not outputfile_path:
+            outputfile_path = "orbit.ephemeris"
+        with open(outputfile_path, 'wb') as file:
+            write_ephemeris(file, tle_src, start_time=start_time, end_time=end_time,
+                            time_step=time_step, dtype=dtype, chunk_size=chunk_size,
+                            colors=colors, cache=cache, stats=stats)
+
+
+def ephemeris_to_czml(ephemeris, outputfile_path=None, precision=None, path_style=None,
+                      frame=INERTIAL, shared_billboard=False, stats=None):
+    """
+    Writes the CZML of an ephemeris file, or of an already loaded Ephemeris, without
+    propagating, the packets are the same as the ones create_czml writes for the same
+    TLEs, window and time step, see tles_to_czml for the options.
+    """
+    if not isinstance(ephemeris, Ephemeris):
+        ephemeris = load_ephemeris(ephemeris)
+    if not outputfile_path:
+        outputfile_path = "orbit.czml"
+
+    start_time, end_time = ephemeris.start_time, ephemeris.end_time
+    doc = create_czml_file(start_time, end_time, shared_billboard)
+    sat_packets = (
+        create_satellite_packet(create_satellite(satellite['tle'], tuple(satellite['rgba'])),
+                                start_time, end_time, ephemeris.get_positions(index),
+                                precision, ephemeris.time_step, path_style=path_style,
+                                stats=stats, frame=frame, shared_billboard=shared_billboard)
+        for index, satellite in enumerate(ephemeris.satellites))
+    doc.packets = chain(doc.packets, sat_packets)
+
+    with open(outputfile_path, 'w') as file:
+        if stats is not None:
+            file = MeasuredWriter(file, stats)
+        doc.dump(file)
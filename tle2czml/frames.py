@@ -0,0 +1,116 @@
+''' converts propagated TEME positions to the earth fixed frame and to geodetic coordinates '''
+
+import math
+from datetime import timezone
+
+from sgp4.ext import jday
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+INERTIAL = 'INERTIAL'
+FIXED = 'FIXED'
+CARTOGRAPHIC_DEGREES = 'cartographicDegrees'
+FRAMES = (INERTIAL, FIXED, CARTOGRAPHIC_DEGREES)
+
+SECONDS_IN_DAY = 86400
+# WGS84 ellipsoid, which cesium uses for cartographic positions
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+WGS84_EP2 = (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+# decimals of a degree are added to the decimals of a metre, as a degree is about 111 km
+DEGREE_DECIMALS = 5
+
+
+def convert_frame(positions, start_time, frame=INERTIAL, precision=None):
+    '''
+    returns a flat [t, x, y, z, ...] buffer of TEME positions in metres, with t in seconds
+    since start_time, in the frame: INERTIAL leaves them as they are, FIXED rotates them by
+    the greenwich mean sidereal time into earth fixed cartesians and cartographicDegrees
+    turns those into [t, longitude, latitude, height, ...] on the WGS84 ellipsoid,
+    all samples are converted at once, if precision is given the result is rounded to that
+    many decimals of a metre
+    '''
+    if frame not in FRAMES:
+        raise ValueError('unknown frame {!r}, use one of {}'.format(frame, FRAMES))
+    if frame == INERTIAL:
+        return positions
+    if np is None:
+        raise ImportError('the {} frame needs numpy'.format(frame))
+
+    samples = np.array(positions, dtype=np.float64).reshape(-1, 4)
+    samples[:, 1:] = teme_to_fixed(samples[:, 0], samples[:, 1:], start_time)
+    if frame == CARTOGRAPHIC_DEGREES:
+        samples[:, 1:] = fixed_to_cartographic_degrees(samples[:, 1:])
+
+    if precision is not None:
+        samples[:, 0] = samples[:, 0].round(precision)
+        if frame == CARTOGRAPHIC_DEGREES:
+            samples[:, 1:3] = samples[:, 1:3].round(precision + DEGREE_DECIMALS)
+            samples[:, 3] = samples[:, 3].round(precision)
+        else:
+            samples[:, 1:] = samples[:, 1:].round(precision)
+    return samples.ravel()
+
+
+def get_gmst(time_steps, start_time):
+    '''
+    returns the greenwich mean sidereal time in radians at time_steps seconds after
+    start_time, with the IAU-82 model sgp4 uses, treating UTC as UT1
+    '''
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone(timezone.utc)
+    # same whole second resolution as the propagated sample times
+    start_jd = jday(start_time.year, start_time.month, start_time.day,
+                    start_time.hour, start_time.minute, start_time.second)
+    tut1 = ((start_jd - 2451545.0) + time_steps / SECONDS_IN_DAY) / 36525.0
+    seconds = (-6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2 +
+               (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+    return np.mod(np.radians(seconds / 240.0), 2 * math.pi)
+
+
+def teme_to_fixed(time_steps, teme_positions, start_time):
+    'rotates an (n, 3) array of TEME positions into the earth fixed frame, ignoring polar motion'
+    gmst = get_gmst(time_steps, start_time)
+    cos_gmst = np.cos(gmst)
+    sin_gmst = np.sin(gmst)
+
+    fixed_positions = np.empty_like(teme_positions)
+    fixed_positions[:, 0] = cos_gmst * teme_positions[:, 0] + sin_gmst * teme_positions[:, 1]
+    fixed_positions[:, 1] = cos_gmst * teme_positions[:, 1] - sin_gmst * teme_positions[:, 0]
+    fixed_positions[:, 2] = teme_positions[:, 2]
+    return fixed_positions
+
+
+def fixed_to_cartographic_degrees(fixed_positions):
+    '''
+    returns an (n, 3) array of earth fixed positions in metres as longitude and latitude in
+    degrees and height in metres on the WGS84 ellipsoid, with the closed form of Zhu (1993)
+    '''
+    x, y, z = fixed_positions[:, 0], fixed_positions[:, 1], fixed_positions[:, 2]
+    p = np.hypot(x, y)
+    z2 = z * z
+
+    big_f = 54 * WGS84_B ** 2 * z2
+    big_g = p * p + (1 - WGS84_E2) * z2 - WGS84_E2 * (WGS84_A ** 2 - WGS84_B ** 2)
+    c = WGS84_E2 ** 2 * big_f * p * p / big_g ** 3
+    s = np.cbrt(1 + c + np.sqrt(c * c + 2 * c))
+    k = s + 1 + 1 / s
+    big_p = big_f / (3 * k * k * big_g * big_g)
+    q = np.sqrt(1 + 2 * WGS84_E2 ** 2 * big_p)
+    # over the poles rounding can take the square root's argument just below zero
+    r0 = (-(big_p * WGS84_E2 * p) / (1 + q) +
+          np.sqrt(np.maximum(WGS84_A ** 2 / 2 * (1 + 1 / q) -
+                             big_p * (1 - WGS84_E2) * z2 / (q * (1 + q)) - big_p * p * p / 2, 0)))
+    u = np.hypot(p - WGS84_E2 * r0, z)
+    v = np.sqrt((p - WGS84_E2 * r0) ** 2 + (1 - WGS84_E2) * z2)
+    z0 = WGS84_B ** 2 * z / (WGS84_A * v)
+
+    cartographic = np.empty_like(fixed_positions)
+    cartographic[:, 0] = np.degrees(np.arctan2(y, x))
+    cartographic[:, 1] = np.degrees(np.arctan2(z + WGS84_EP2 * z0, p))
+    cartographic[:, 2] = u * (1 - WGS84_B ** 2 / (WGS84_A * v))
+    return cartographic
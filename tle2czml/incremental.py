@@ -0,0 +1,119 @@
+''' regenerates czml for updated TLE catalogs, only converting the satellites that changed '''
+
+import hashlib
+
+from .czml import SerializedPacket, get_serializer
+from .frames import INERTIAL
+from .tle2czml import (Colors, create_czml_file, create_satellite_packets,
+                       create_satellite_packets_parallel, get_sampling_time_step,
+                       get_time_window, iter_tles)
+
+
+class IncrementalConverter:
+    '''
+    Converts TLE catalogs to CZML, keeping the serialized packet of every satellite from the
+    previous conversion keyed by a hash of its TLE lines and color, so that converting an updated
+    catalog only propagates the satellites that were added or changed, removed satellites are
+    dropped and the packets of unchanged satellites are written out as they are.
+
+    Unless colors is a function, the color of a satellite is picked from the palette by its NORAD
+    id rather than its place in the catalog, so adding or removing a satellite does not change
+    the colors, and so the packets, of the satellites after it.
+
+    The time window is fixed when the converter is created unless it is passed to convert,
+    a different window or JSON serializer than the previous conversion converts everything again.
+    '''
+
+    def __init__(self, start_time=None, end_time=None, chunk_size=None, workers=None,
+                 precision=None, time_step=None, adaptive_sampling=False,
+                 sampling_tolerance=None, cache=None, path_style=None, colors=None,
+                 frame=INERTIAL, shared_billboard=False):
+        self.start_time, self.end_time = get_time_window(start_time, end_time)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.colors = colors if callable(colors) else get_norad_colors(colors)
+        self.packet_options = dict(
+            precision=precision, cache=cache, path_style=path_style, frame=frame,
+            shared_billboard=shared_billboard,
+            time_step=get_sampling_time_step(time_step, adaptive_sampling, sampling_tolerance))
+
+        self.fragments = {}
+        self.converted = 0
+        self.reused = 0
+        self.removed = 0
+        self._signature = None
+
+    def convert(self, tles, start_time=None, end_time=None, silent=True):
+        '''
+        converts the tles, which can be a string, an open TLE file or any iterable of lines,
+        and returns the CZML as a string
+        '''
+        return str(self.create_document(tles, start_time, end_time, silent))
+
+    def write(self, file, tles, start_time=None, end_time=None, silent=True):
+        'converts the tles and writes the CZML to the file object'
+        self.create_document(tles, start_time, end_time, silent).dump(file)
+
+    def create_document(self, tles, start_time=None, end_time=None, silent=True):
+        'returns the CZML doc of the tles, with the packets of unchanged satellites spliced in'
+        if start_time:
+            self.start_time, self.end_time = get_time_window(start_time, end_time)
+        elif end_time:
+            self.end_time = end_time
+
+        # the window as written and a copy of the serializer's options, so that the same times
+        # in another timezone or changing the serializer in place also convert everything again
+        signature = (self.start_time.isoformat(), self.end_time.isoformat(),
+                     dict(vars(get_serializer())))
+        if signature != self._signature:
+            self.fragments = {}
+            self._signature = signature
+
+        if isinstance(tles, str):
+            tles = tles.splitlines()
+
+        keys = []
+        # satellites to convert, by hash, in catalog order
+        changed = {}
+        for sat in iter_tles(tles, Colors(self.colors)):
+            key = get_tle_hash(sat)
+            if key not in self.fragments and key not in changed:
+                changed[key] = sat
+            keys.append(key)
+
+        fragments = dict((key, self.fragments[key]) for key in keys if key in self.fragments)
+        sat_packets = self._create_packets(list(changed.values()), silent)
+        for key, sat_packet in zip(changed, sat_packets):
+            fragments[key] = sat_packet.dumps()
+
+        self.converted = len(changed)
+        self.reused = len(keys) - len(changed)
+        self.removed = len(set(self.fragments) - set(fragments))
+        self.fragments = fragments
+
+        doc = create_czml_file(self.start_time, self.end_time,
+                               self.packet_options['shared_billboard'])
+        for key in keys:
+            doc.packets.append(SerializedPacket(fragments[key]))
+        return doc
+
+    def _create_packets(self, satellites, silent):
+        if self.workers and self.workers > 1:
+            return create_satellite_packets_parallel(
+                satellites, self.start_time, self.end_time, self.workers, self.chunk_size,
+                silent, **self.packet_options)
+        return create_satellite_packets(
+            satellites, self.start_time, self.end_time, self.chunk_size, silent,
+            **self.packet_options)
+
+
+def get_tle_hash(sat):
+    'returns a hash of the lines and color of a satellite, which identifies its packet'
+    tle = '\n'.join([line.rstrip() for line in sat.raw_tle] + [repr(list(sat.rgba))])
+    return hashlib.sha256(tle.encode('utf-8')).hexdigest()
+
+
+def get_norad_colors(palette=None):
+    'returns a function picking the color of a NORAD id from the palette, see Colors'
+    rgbs = Colors(palette).get_rgbs()
+    return lambda satnum: rgbs[satnum % len(rgbs)]
@@ -0,0 +1,28 @@
+''' imports heavy optional modules on first use, so that importing tle2czml stays cheap '''
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    '''
+    returns the module, which is only executed when one of its attributes is first used,
+    or None when it is not installed, like the try/except ImportError of an optional import
+    '''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None:
+        return None
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,91 @@
+''' generates czml in time chunks for live cesium clients '''
+
+import math
+from datetime import timedelta
+
+from .czml import CZML, CZMLPacket
+from .frames import INERTIAL
+from .tle2czml import (Colors, create_czml_file, create_position, create_satellite_packet,
+                       get_number_of_positions, get_sampling_time_step, get_time_step,
+                       get_time_window, iter_tles, propagate_positions)
+
+CHUNK_DURATION = timedelta(minutes=10)
+
+
+def iter_czml_chunks(tles, start_time=None, end_time=None, chunk_duration=CHUNK_DURATION,
+                     precision=None, time_step=None, adaptive_sampling=False,
+                     sampling_tolerance=None, path_style=None, colors=None, frame=INERTIAL,
+                     shared_billboard=False):
+    '''
+    Converts TLEs to CZML one time chunk of chunk_duration at a time and yields a CZML doc per
+    chunk, only the first chunk's positions are propagated before the first doc is yielded.
+
+    The first doc has the document packet and the full packet of every satellite, with the
+    positions of the first chunk. Later docs only have a packet per satellite with the same
+    'Satellite/<name>' id and the positions of their chunk, which a cesium client merges into
+    the existing satellite, so the position samples add up to the ones tles_to_czml writes.
+    '''
+    if isinstance(tles, str):
+        tles = tles.splitlines()
+
+    start_time, end_time = get_time_window(start_time, end_time)
+    time_step = get_sampling_time_step(time_step, adaptive_sampling, sampling_tolerance)
+
+    satellites = list(iter_tles(tles, Colors(colors)))
+    steps = [get_time_step(sat, time_step) for sat in satellites]
+
+    for chunk in range(get_number_of_chunks(start_time, end_time, chunk_duration)):
+        yield create_czml_chunk(satellites, steps, start_time, end_time, chunk_duration, chunk,
+                                precision, path_style, frame, shared_billboard)
+
+
+def get_number_of_chunks(start_time, end_time, chunk_duration=CHUNK_DURATION):
+    'returns the number of chunks of chunk_duration between start_time and end_time'
+    return max(int(math.ceil((end_time - start_time) / chunk_duration)), 1)
+
+
+def create_czml_chunk(satellites, steps, start_time, end_time, chunk_duration, chunk,
+                      precision=None, path_style=None, frame=INERTIAL, shared_billboard=False):
+    '''
+    returns the CZML doc of one chunk, see iter_czml_chunks, steps are the seconds between
+    samples of each satellite
+    '''
+    chunk_start = start_time + chunk * chunk_duration
+    chunk_end = min(chunk_start + chunk_duration, end_time)
+    last_chunk = chunk == get_number_of_chunks(start_time, end_time, chunk_duration) - 1
+
+    if chunk == 0:
+        doc = create_czml_file(start_time, end_time, shared_billboard)
+    else:
+        doc = CZML()
+
+    for sat, step in zip(satellites, steps):
+        # samples stay on the grid of the whole window, the last chunk also gets
+        # the samples after the end time that tles_to_czml adds
+        first_sample = _get_first_sample(start_time, chunk_start, step)
+        if last_chunk:
+            last_sample = get_number_of_positions(start_time, end_time, step)
+        else:
+            last_sample = _get_first_sample(start_time, chunk_end, step)
+        if last_sample <= first_sample:
+            continue
+
+        sample_start = start_time + timedelta(seconds=first_sample * step)
+        positions = propagate_positions(sat, last_sample - first_sample, sample_start, step)
+
+        if chunk == 0:
+            packet = create_satellite_packet(sat, start_time, end_time, positions, precision,
+                                             path_style=path_style, frame=frame,
+                                             shared_billboard=shared_billboard)
+        else:
+            packet = CZMLPacket(id='Satellite/{}'.format(sat.sat_name))
+            packet.position = create_position(sample_start, chunk_end, sat, positions, precision,
+                                              frame=frame)
+        doc.packets.append(packet)
+
+    return doc
+
+
+def _get_first_sample(start_time, chunk_start, time_step):
+    'returns the index of the first sample at or after chunk_start'
+    return int(math.ceil((chunk_start - start_time).total_seconds() / time_step))
@@ -0,0 +1,424 @@
+''' asyncio http server converting local TLEs to czml, with server-sent events for live clients
+
+usage: python -m tle2czml.serve [--tle-dir DIRECTORY] [--host HOST] [--port PORT] [--workers N]
+
+    GET  /czml?start=...&end=...     the whole CZML document of the window
+    GET  /stream?start=...&end=...   the CZML in time chunks as server-sent events
+    POST /tles                       replaces the catalog with the TLEs in the request body
+
+start and end are ISO 8601 times, by default the window starts at the current time rounded
+down to the chunk duration and lasts 24 hours, so that viewers connecting around the same
+time share one conversion. Everything runs locally, no TLEs are downloaded.
+'''
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
+
+from dateutil import parser
+
+from .frames import FRAMES, INERTIAL
+from .live import CHUNK_DURATION, create_czml_chunk, get_number_of_chunks
+from .tle2czml import (Colors, get_sampling_time_step, get_time_step, iter_tles,
+                       tles_to_czml)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_WINDOW = timedelta(hours=24)
+POLL_INTERVAL = 5
+RESULT_CACHE_BYTES = 256 * 1024 * 1024
+CATALOG_CACHE_SIZE = 2
+MAX_UPLOAD_BYTES = 256 * 1024 * 1024
+TLE_FILE_EXTENSIONS = ('.txt', '.tle')
+
+logger = logging.getLogger(__name__)
+
+STATUS_REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+                  405: 'Method Not Allowed', 411: 'Length Required', 413: 'Payload Too Large',
+                  500: 'Internal Server Error'}
+
+
+class TLESource:
+    'The current TLE catalog, read from the TLE files in a directory or uploaded'
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        # replaced as a whole, as refresh runs in a thread while requests read the catalog
+        self.catalog = ('', get_version(''))
+        self._mtimes = None
+
+    @property
+    def text(self):
+        'the TLEs of the catalog'
+        return self.catalog[0]
+
+    @property
+    def version(self):
+        'the hash of the catalog, see get_version'
+        return self.catalog[1]
+
+    def refresh(self):
+        'reads the directory again if its TLE files changed, returns whether the catalog changed'
+        if not self.directory:
+            return False
+
+        paths = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                       if name.lower().endswith(TLE_FILE_EXTENSIONS))
+        mtimes = [(path, os.stat(path).st_mtime) for path in paths]
+        if mtimes == self._mtimes:
+            return False
+
+        # read as uploaded, so that uploading a file gives the same version as reading it
+        texts = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8', newline='') as tle_file:
+                text = tle_file.read()
+            if texts and not texts[-1].endswith('\n'):
+                texts.append('\n')
+            texts.append(text)
+        self._mtimes = mtimes
+        changed = self.upload(''.join(texts))
+        if changed:
+            logger.info('Read %d TLE files, catalog version %s', len(paths), self.version)
+        return changed
+
+    def upload(self, text):
+        'replaces the catalog, returns whether it changed'
+        version = get_version(text)
+        if version == self.version:
+            return False
+        self.catalog = (text, version)
+        return True
+
+
+class ResultCache:
+    '''
+    The futures of conversions by key, running conversions are always shared and the CZML of
+    finished ones is kept, least recently used first out, while it fits in max_bytes
+    '''
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._futures = OrderedDict()
+        self._sizes = {}
+
+    def get(self, key):
+        'returns the future of key, or None'
+        future = self._futures.get(key)
+        if future is not None:
+            self._futures.move_to_end(key)
+        return future
+
+    def add(self, key, future):
+        'shares the future under key, once it is done its result is kept or evicted'
+        self._futures[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+
+    def _finished(self, key, future):
+        if self._futures.get(key) is not future:
+            return
+        if future.cancelled() or future.exception() is not None:
+            del self._futures[key]
+            return
+
+        self._sizes[key] = len(future.result())
+        self.size += self._sizes[key]
+        for old_key in list(self._futures):
+            if self.size <= self.max_bytes:
+                break
+            if old_key in self._sizes:
+                del self._futures[old_key]
+                self.size -= self._sizes.pop(old_key)
+
+
+class CZMLServer:
+    '''
+    Serves the CZML of a TLESource, conversions run in a process pool off the event loop and
+    requests for the same catalog version and window share one conversion, whole documents
+    and stream chunks are kept in separate caches of cache_bytes each
+    '''
+
+    def __init__(self, source, workers=None, chunk_duration=CHUNK_DURATION,
+                 poll_interval=POLL_INTERVAL, window=DEFAULT_WINDOW,
+                 cache_bytes=RESULT_CACHE_BYTES, **czml_options):
+        self.source = source
+        self.chunk_duration = chunk_duration
+        self.window = window
+        self.documents = ResultCache(cache_bytes)
+        self.chunks = ResultCache(cache_bytes)
+        self.poll_interval = poll_interval
+        self.czml_options = czml_options
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        'serves until cancelled'
+        self.source.refresh()
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info('Serving CZML on http://%s:%s', host, port)
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.executor.shutdown(wait=False)
+
+    async def watch(self):
+        'polls the TLE directory for changes'
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await loop.run_in_executor(None, self.source.refresh)
+
+    def get_result(self, cache, key, function, *args):
+        '''
+        returns a future of function(*args) run in the process pool, sharing the future of
+        an earlier call with the same key in the ResultCache
+        '''
+        future = cache.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            cache.add(key, future)
+        return future
+
+    async def handle(self, reader, writer):
+        'handles one http request'
+        try:
+            method, target, headers = await read_request_head(reader)
+            url = urlsplit(target)
+            query = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+
+            if url.path == '/tles':
+                if method != 'POST':
+                    await respond(writer, 405, {'error': 'use POST'})
+                    return
+                await self.handle_upload(reader, writer, headers)
+            elif url.path in ('/czml', '/stream'):
+                if method != 'GET':
+                    await respond(writer, 405, {'error': 'use GET'})
+                    return
+                start_time, end_time = self.get_window(query)
+                if url.path == '/czml':
+                    await self.handle_czml(writer, start_time, end_time)
+                else:
+                    await self.handle_stream(writer, start_time, end_time)
+            else:
+                await respond(writer, 404, {'error': 'not found'})
+        except ValueError as error:
+            await respond(writer, 400, {'error': str(error)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as error:
+            await respond(writer, 500, {'error': repr(error)})
+        finally:
+            writer.close()
+
+    def get_window(self, query):
+        'returns the start and end time requested in the query'
+        if 'start' in query:
+            start_time = _aware(parser.isoparse(query['start']))
+        else:
+            now = datetime.now(timezone.utc)
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            start_time = midnight + ((now - midnight) // self.chunk_duration) * self.chunk_duration
+
+        if 'end' in query:
+            end_time = _aware(parser.isoparse(query['end']))
+        else:
+            end_time = start_time + self.window
+
+        if end_time <= start_time:
+            raise ValueError('end must be after start')
+        return start_time, end_time
+
+    async def handle_upload(self, reader, writer, headers):
+        'replaces the catalog with the TLEs in the body, the old catalog is kept if they are invalid'
+        if 'content-length' not in headers or 'transfer-encoding' in headers:
+            await respond(writer, 411, {'error': 'send the TLEs with a Content-Length'})
+            return
+        length = int(headers['content-length'])
+        if length > MAX_UPLOAD_BYTES:
+            await respond(writer, 413, {'error': 'upload too large'})
+            return
+        body = await reader.readexactly(length)
+        text = body.decode('utf-8')
+        # raises a ValueError, answered with a 400, before the catalog is replaced
+        await asyncio.get_running_loop().run_in_executor(None, check_tles, text)
+        self.source.upload(text)
+        await respond(writer, 200, {'version': get_version(text)})
+
+    async def handle_czml(self, writer, start_time, end_time):
+        text, version = self.source.catalog
+        key = get_window_key(version, start_time, end_time)
+        czml = await self.get_result(self.documents, key, _convert, text, start_time, end_time,
+                                     self.czml_options)
+        await respond(writer, 200, czml)
+
+    async def handle_stream(self, writer, start_time, end_time):
+        text, version = self.source.catalog
+        writer.write(_response_head(200, 'text/event-stream', {'Cache-Control': 'no-cache'}))
+
+        number_of_chunks = get_number_of_chunks(start_time, end_time, self.chunk_duration)
+        for chunk in range(number_of_chunks):
+            key = get_window_key(version, start_time, end_time) + (self.chunk_duration, chunk)
+            try:
+                czml = await self.get_result(self.chunks, key, _convert_chunk, text, version, start_time,
+                                             end_time, self.chunk_duration, chunk,
+                                             self.czml_options)
+            except Exception as error:
+                # the response already started, so the error is sent as an event
+                writer.write('event: error\ndata: {}\n\n'.format(
+                    json.dumps({'error': repr(error)})).encode('utf-8'))
+                await writer.drain()
+                return
+            writer.write('id: {}\nevent: czml\ndata: {}\n\n'.format(chunk, czml).encode('utf-8'))
+            await writer.drain()
+
+        writer.write(b'event: end\ndata: {}\n\n')
+        await writer.drain()
+
+
+async def read_request_head(reader):
+    'returns the method, target and lower case headers of an http request'
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise ValueError('malformed request line')
+
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method.upper(), target, headers
+
+
+async def respond(writer, status, body, content_type='application/json'):
+    'writes a whole http response, body can be a string or JSON data'
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    body = body.encode('utf-8')
+    writer.write(_response_head(status, content_type, {'Content-Length': str(len(body))}) +
+                 body)
+    await writer.drain()
+
+
+def _response_head(status, content_type, headers):
+    lines = ['HTTP/1.1 {} {}'.format(status, STATUS_REASONS[status]),
+             'Content-Type: ' + content_type,
+             'Access-Control-Allow-Origin: *',
+             'Connection: close']
+    lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def _aware(time):
+    if time.tzinfo is None:
+        return time.replace(tzinfo=timezone.utc)
+    return time
+
+
+def _convert(text, start_time, end_time, czml_options):
+    'runs in a worker process, converts the whole window'
+    return tles_to_czml(text, start_time=start_time, end_time=end_time, silent=True,
+                        **czml_options)
+
+
+# satellites and steps of the latest catalog versions parsed by this worker process
+_catalogs = OrderedDict()
+
+
+def _convert_chunk(text, version, start_time, end_time, chunk_duration, chunk, czml_options):
+    'runs in a worker process, converts one chunk of the window'
+    satellites, steps = _get_catalog(text, version, czml_options)
+    return str(create_czml_chunk(satellites, steps, start_time, end_time, chunk_duration,
+                                 chunk, czml_options.get('precision'),
+                                 czml_options.get('path_style'),
+                                 czml_options.get('frame', INERTIAL),
+                                 czml_options.get('shared_billboard', False)))
+
+
+def _get_catalog(text, version, czml_options):
+    'returns the satellites and steps of a catalog version, parsing it once per worker process'
+    catalog = _catalogs.get(version)
+    if catalog is not None:
+        _catalogs.move_to_end(version)
+        return catalog
+
+    time_step = get_sampling_time_step(czml_options.get('time_step'))
+    satellites = list(iter_tles(text.splitlines(), Colors()))
+    catalog = (satellites, [get_time_step(sat, time_step) for sat in satellites])
+    _catalogs[version] = catalog
+    while len(_catalogs) > CATALOG_CACHE_SIZE:
+        _catalogs.popitem(last=False)
+    return catalog
+
+
+def check_tles(text):
+    'raises a ValueError if the text is not a catalog of three line TLEs'
+    lines = text.splitlines()
+    if len(lines) % 3:
+        raise ValueError('the TLEs need three lines each, got {} lines'.format(len(lines)))
+    try:
+        for _ in iter_tles(lines, Colors()):
+            pass
+    except ValueError as error:
+        raise ValueError('invalid TLEs: {}'.format(str(error).splitlines()[0]))
+
+
+def get_window_key(version, start_time, end_time):
+    'returns the cache key of a window of a catalog version'
+    # equal times in different timezones are written differently, so they are keyed as strings
+    return (version, start_time.isoformat(), end_time.isoformat())
+
+
+def get_version(text):
+    'returns a hash identifying the contents of a catalog'
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def main(args=None):
+    'runs the server from the command line'
+    arg_parser = argparse.ArgumentParser(description='Serves the CZML of local TLE files')
+    arg_parser.add_argument('--tle-dir', help='directory of .txt or .tle files to watch')
+    arg_parser.add_argument('--host', default=DEFAULT_HOST)
+    arg_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help='number of conversion processes')
+    arg_parser.add_argument('--chunk-minutes', type=float, default=10,
+                            help='duration of the chunks streamed to live clients')
+    arg_parser.add_argument('--precision', type=int, default=None,
+                            help='decimals of a metre positions are rounded to')
+    arg_parser.add_argument('--frame', choices=FRAMES, default=INERTIAL,
+                            help='reference frame of the positions')
+    arg_parser.add_argument('--path-style', choices=['sampled', 'constant'], default=None,
+                            help='compact lead and trail times of the orbit paths')
+    arg_parser.add_argument('--shared-billboard', action='store_true',
+                            help='write the billboard image once instead of per satellite')
+    options = arg_parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    server = CZMLServer(TLESource(options.tle_dir), workers=options.workers,
+                        chunk_duration=timedelta(minutes=options.chunk_minutes),
+                        precision=options.precision, path_style=options.path_style,
+                        frame=options.frame, shared_billboard=options.shared_billboard)
+    try:
+        asyncio.run(server.serve(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+''' records where the time of a conversion goes, stage by stage '''
+
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+STAGES = ('parse', 'propagate', 'path', 'serialize', 'write')
+
+# shared by every stage that is not measured, so that costs nothing but the with statement
+_NOT_MEASURED = nullcontext()
+
+
+class ConversionStats:
+    '''
+    Records the wall time, number of calls and number of items of each stage of a conversion,
+    pass one as stats to tles_to_czml, write_czml or create_czml. The items are satellites,
+    except for serialize where they are packets and write where they are characters written.
+    With worker processes the time the workers take to parse their satellites again is
+    recorded as the worker_parse stage.
+
+    callback, if given, is called with the stage, seconds and items of every measurement,
+    measurements made in worker processes are merged in when their task is done.
+    '''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = dict((stage, {'seconds': 0.0, 'calls': 0, 'items': 0}) for stage in STAGES)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage, items=1):
+        'records the time the block takes as one call of the stage'
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, items=items)
+
+    def add(self, stage, seconds, calls=1, items=1):
+        'adds a measurement to the stage'
+        with self._lock:
+            record = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0, 'items': 0})
+            record['seconds'] += seconds
+            record['calls'] += calls
+            record['items'] += items
+        if self.callback is not None:
+            self.callback(stage, seconds, items)
+
+    def merge(self, stats):
+        'adds the measurements of another ConversionStats or of its as_dict()'
+        if isinstance(stats, ConversionStats):
+            stats = stats.as_dict()
+        for stage, record in stats.items():
+            self.add(stage, record['seconds'], record['calls'], record['items'])
+
+    def as_dict(self):
+        'returns the measurements as {stage: {seconds, calls, items}}'
+        with self._lock:
+            return dict((stage, dict(record)) for stage, record in self.stages.items())
+
+    def to_json(self, **kwargs):
+        'returns the measurements as JSON, kwargs are passed on to json.dumps'
+        return json.dumps(self.as_dict(), **kwargs)
+
+    @property
+    def seconds(self):
+        'the total seconds of all stages'
+        return sum(record['seconds'] for record in self.as_dict().values())
+
+    def __repr__(self):
+        return 'ConversionStats({})'.format(self.to_json())
+
+
+def measure(stats, stage, items=1):
+    'returns a context manager measuring a stage, which does nothing when stats is None'
+    if stats is None:
+        return _NOT_MEASURED
+    return stats.measure(stage, items)
+
+
+def measure_iterable(iterable, stats, stage):
+    'yields the items of iterable, measuring the time taken to produce each as the stage'
+    if stats is None:
+        yield from iterable
+        return
+
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        stats.add(stage, time.perf_counter() - start)
+        yield item
+
+
+class MeasuredWriter:
+    'wraps a file object, measuring the time of every write as the write stage'
+
+    def __init__(self, fp, stats):
+        self.fp = fp
+        self.stats = stats
+
+    def write(self, text):
+        with self.stats.measure('write', len(text)):
+            return self.fp.write(text)
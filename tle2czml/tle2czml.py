@@ -1,16 +1,26 @@
 ''' generates .czml file or json used to visualize the satellites orbits '''
 
+import logging
 import math
-from datetime import datetime, timedelta
+import os
+import time
+from array import array
+from collections import deque
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from itertools import chain
 
-import pkg_resources
-import pytz
-from dateutil import parser
 from sgp4.earth_gravity import wgs72
+from sgp4.ext import days2mdhms
 from sgp4.io import twoline2rv
+from sgp4.propagation import sgp4 as sgp4_propagate
 
+from .cache import WGS72, Satrec, SatrecArray, TLECache, jday, np
+from .frames import CARTOGRAPHIC_DEGREES, INERTIAL, convert_frame
 from .czml import (CZML, Billboard, CZMLPacket, Description, Label, Path,
-                   Position)
+                   Position, SerializedPacket, get_serializer, set_serializer)
+from .stats import ConversionStats, MeasuredWriter, measure, measure_iterable
 
 BILLBOARD_SCALE = 1.5
 LABEL_FONT = "11pt Lucida Console"
@@ -24,24 +34,76 @@ SATELITE_IMAGE_URI = ("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAY
 MULTIPLIER = 60
 DESCRIPTION_TEMPLATE = 'Orbit of Satellite: '
 MINUTES_IN_DAY = 1440
+SECONDS_IN_DAY = 86400
 TIME_STEP = 300
+ADAPTIVE_SAMPLES_PER_ORBIT = 18
+MIN_TIME_STEP = 10
+MAX_TIME_STEP = 3600
+CATALOG_CHUNK_SIZE = 1000
+WORKER_TASK_SIZE = 64
+TIME_CONTEXT_CACHE_SIZE = 32
+SAMPLE_TIMES_CACHE_SIZE = 64
+
+PATH_STYLES = (None, 'sampled', 'constant')
+PATH_SAMPLE_GAP = 1
+
+PROGRESS_INTERVAL = 0.5
+PALETTE_FILE = 'rgba_list.txt'
+
+# with shared_billboard the satellites reference the billboard image of this packet
+TEMPLATE_ID = 'Template/Satellite'
+BILLBOARD_IMAGE_REFERENCE = TEMPLATE_ID + '#billboard.image'
 
 DEFAULT_RGBA = [213, 255, 0, 255]
-DEBUGGING = False
+
+logger = logging.getLogger(__name__)
 
 
 class Satellite:
     'Common base class for all satellites'
 
-    def __init__(self, raw_tle, tle_object, rgba):
+    def __init__(self, raw_tle, tle_object, rgba, satrec=None):
         self.raw_tle = raw_tle
-        self.tle_object = tle_object  # sgp4Object
+        self._tle_object = tle_object  # sgp4Object
         self.rgba = rgba
         self.sat_name = raw_tle[0].rstrip()
         # extracts the number of orbits per day from the tle and calcualtes the time per orbit
         self.orbital_time_in_minutes = (
             24.0/float(self.raw_tle[2][52:63]))*60.0
-        self.tle_epoch = tle_object.epoch
+        self._satrec = satrec
+
+    @property
+    def tle_object(self):
+        'Returns the legacy sgp4 object, only initialized once the legacy propagator needs it'
+        if self._tle_object is None:
+            self._tle_object = twoline2rv(self.raw_tle[1].rstrip(), self.raw_tle[2].rstrip(),
+                                           wgs72)
+        return self._tle_object
+
+    @property
+    def satrec(self):
+        'Returns the sgp4 Satrec object used for batch propagation, or None if unavailable'
+        if self._satrec is None and Satrec is not None:
+            self._satrec = Satrec.twoline2rv(self.raw_tle[1], self.raw_tle[2], WGS72)
+        return self._satrec
+
+    @property
+    def elements(self):
+        'Returns the Satrec, or the legacy sgp4 object without it, to read satnum and ecco from'
+        satrec = self.satrec
+        return satrec if satrec is not None else self.tle_object
+
+    @property
+    def tle_epoch(self):
+        'The tle epoch as a naive UTC datetime'
+        satrec = self.satrec
+        if satrec is None:
+            return self.tle_object.epoch
+        # worked out the same way as the epoch of the legacy sgp4 object
+        year = satrec.epochyr + (1900 if satrec.epochyr >= 57 else 2000)
+        month, day, hour, minute, second = days2mdhms(year, satrec.epochdays)
+        return datetime(year, month, day, hour, minute, int(second // 1.0),
+                        int(second % 1.0 * 1000000.0 // 1.0))
 
     def get_satellite_name(self):
         'Returns satellite name'
@@ -53,24 +115,64 @@ class Satellite:
 
 
 
-class Colors:
-    'defines rgba colors for satellites'
+# sgp4 objects of the TLEs converted by this process, see TLECache
+tle_cache = TLECache()
+
+
+def create_satellite(raw_tle, rgba):
+    'returns a Satellite, reusing the sgp4 objects of the same tle lines from the tle_cache'
+    tle_object, satrec = tle_cache.get(raw_tle[1], raw_tle[2])
+    return Satellite(raw_tle, tle_object, rgba, satrec)
+
+
+@lru_cache(maxsize=None)
+def get_palette():
+    '''
+    returns the default satellite colors as a tuple of (r, g, b, a) integer tuples,
+    rgba_list.txt is only read the first time
+    '''
+    from importlib import resources
 
-    def __init__(self):
-        path = 'rgba_list.txt'
-        filepath = pkg_resources.resource_filename(__name__, path)
-        colors_file = open(filepath, 'r')
+    colors_text = resources.files(__package__).joinpath(PALETTE_FILE).read_text()
+    return tuple(get_rgba(color.split()) for color in colors_text.splitlines() if color.strip())
 
-        rgbs = []
 
-        for color in colors_file:
-            rgb = color.split()
-            rgb.append(255)  # append value for alpha
-            rgbs.append(rgb)
+def get_rgba(color):
+    'returns a color of 3 or 4 components as an (r, g, b, a) integer tuple'
+    rgba = tuple(int(component) for component in color)
+    if len(rgba) == 3:
+        rgba += (255,)  # append value for alpha
+    if len(rgba) != 4:
+        raise ValueError('colors need 3 or 4 components, not {!r}'.format(color))
+    return rgba
 
-        self.rgbs = rgbs
+
+class Colors:
+    '''
+    Cycles through the rgba colors of a palette for satellites, palette can be a sequence of
+    (r, g, b) or (r, g, b, a) colors, None for the default palette, or a function returning
+    the color of a NORAD id, which colors every satellite the same in every run
+    '''
+
+    def __init__(self, palette=None):
+        self.color_function = None
+        if palette is None:
+            self.rgbs = get_palette()
+        elif callable(palette):
+            self.color_function = palette
+            self.rgbs = get_palette()
+        else:
+            self.rgbs = tuple(get_rgba(color) for color in palette)
+            if not self.rgbs:
+                raise ValueError('the palette has no colors')
         self.index = 0
 
+    def get_color(self, sat):
+        'returns the color of a Satellite'
+        if self.color_function is not None:
+            return get_rgba(self.color_function(sat.elements.satnum))
+        return self.get_next_color()
+
     def get_next_color(self):
         'returns next color'
         next_color = self.rgbs[self.index]
@@ -87,37 +189,65 @@ class Colors:
 
 
 # create CZML doc with default document packet
-def create_czml_file(start_time, end_time):
-    'create czml file using start_time and end_time'
-    interval = get_interval(start_time, end_time)
+def create_czml_file(start_time, end_time, shared_billboard=False):
+    '''
+    create czml file using start_time and end_time,
+    with the template packet the satellites reference if shared_billboard
+    '''
+    times = get_time_context(start_time, end_time)
     doc = CZML()
     packet = CZMLPacket(id='document', version='1.0')
-    print(interval)
-    print(start_time.isoformat())
+    logger.debug('Document interval: %s, current time: %s', times.interval, times.start_iso)
 
-    packet.clock = {"interval": interval, "currentTime": start_time.isoformat(
-    ), "multiplier": MULTIPLIER, "range": "LOOP_STOP", "step": "SYSTEM_CLOCK_MULTIPLIER"}
+    packet.clock = {"interval": times.interval, "currentTime": times.start_iso,
+                    "multiplier": MULTIPLIER, "range": "LOOP_STOP",
+                    "step": "SYSTEM_CLOCK_MULTIPLIER"}
     doc.packets.append(packet)
+    if shared_billboard:
+        doc.packets.append(create_template_packet())
     return doc
 
 
-def create_satellite_packet(sat, sim_start_time, sim_end_time):
-    'Takes a satelite and returns its orbit'
-    availability = get_interval(sim_start_time, sim_end_time)
+def create_template_packet():
+    '''
+    returns the packet holding the billboard image once for the whole document,
+    it has no position so cesium does not show it
+    '''
+    packet = CZMLPacket(id=TEMPLATE_ID)
+    packet.billboard = create_bill_board()
+    return packet
+
+
+def create_satellite_packet(sat, sim_start_time, sim_end_time, positions=None, precision=None,
+                            time_step=TIME_STEP, cache=None, path_style=None, stats=None,
+                            frame=INERTIAL, shared_billboard=False):
+    '''
+    Takes a satelite and returns its orbit,
+    positions can be passed in if they have already been propagated,
+    the path and propagation are measured if a ConversionStats is given,
+    if shared_billboard the billboard image references the template packet
+    '''
+    # the window's strings and sample times are shared by all packets of a conversion
+    availability = get_time_context(sim_start_time, sim_end_time).interval
     packet = CZMLPacket(id='Satellite/{}'.format(sat.sat_name))
     packet.availability = availability
     packet.description = Description("{} {}".format(DESCRIPTION_TEMPLATE, sat.sat_name))
-    packet.billboard = create_bill_board()
+    packet.billboard = create_bill_board(shared_billboard)
     packet.label = create_label(sat.sat_name, sat.rgba)
-    packet.path = create_path(availability, sat, sim_start_time, sim_end_time)
-    packet.position = create_position(sim_start_time, sim_end_time, sat.tle_object)
+    with measure(stats, 'path'):
+        packet.path = create_path(availability, sat, sim_start_time, sim_end_time, path_style)
+    packet.position = create_position(sim_start_time, sim_end_time, sat, positions, precision,
+                                      time_step, cache, stats, frame)
     return packet
 
 
-def create_bill_board():
-    'returns a billboard'
+def create_bill_board(shared=False):
+    'creates a billboard, its image references the template packet if shared'
     bill_board = Billboard(scale=BILLBOARD_SCALE, show=True)
-    bill_board.image = SATELITE_IMAGE_URI
+    if shared:
+        bill_board.image = {"reference": BILLBOARD_IMAGE_REFERENCE}
+    else:
+        bill_board.image = SATELITE_IMAGE_URI
     return bill_board
 
 
@@ -135,8 +265,15 @@ def create_label(sat_id, rgba):
     return lab
 
 
-def create_path(total_path_interval, sat, sim_start_time, sim_end_time):
-    'creates a lead and trailing path'
+def create_path(total_path_interval, sat, sim_start_time, sim_end_time, path_style=None):
+    '''
+    creates a lead and trailing path, by default as one lead and one trail interval per orbit,
+    path_style 'sampled' writes them as one sampled number series each and 'constant' as
+    half an orbit each, see create_sampled_lead_trail_times
+    '''
+    if path_style not in PATH_STYLES:
+        raise ValueError('unknown path style {!r}, use one of {}'.format(path_style, PATH_STYLES))
+
     path = Path()
 
     path.show = [{"interval": total_path_interval, "boolean": True}]
@@ -144,98 +281,280 @@ def create_path(total_path_interval, sat, sim_start_time, sim_end_time):
     path.material = {"solidColor": {"color": {"rgba": sat.rgba}}}
     path.resolution = 120
 
-    start_epoch_str = total_path_interval.split("/")[0]
+    if path_style == 'constant':
+        # lead and trail always add up to the whole orbit, like the per orbit intervals
+        path.leadTime = path.trailTime = sat.orbital_time_in_minutes * 30.0
+        return path
 
-    minutes_in_sim = int((sim_end_time - sim_start_time).total_seconds()/60)
+    if path_style == 'sampled':
+        path.leadTime, path.trailTime = create_sampled_lead_trail_times(
+            total_path_interval.split("/")[0], sat, sim_start_time, sim_end_time)
+        return path
+
+    times = get_time_context(sim_start_time, sim_end_time)
+    minutes_in_sim = int(times.seconds/60)
 
     left_over_minutes = minutes_in_sim % sat.orbital_time_in_minutes
     number_of_full_orbits = math.floor(minutes_in_sim/sat.orbital_time_in_minutes)
 
-    sub_path_interval_start = parser.parse(start_epoch_str)
+    sub_path_interval_start = times.start_time
+    sub_path_epoch_str = times.start_iso
     # first interval roughly half an orbit, rest of the path intervals are full orbits
     sub_path_interval_end = sub_path_interval_start + timedelta(minutes=left_over_minutes)
-    sub_path_interval_str = (sub_path_interval_start.isoformat() + '/' +
-                             sub_path_interval_end.isoformat())
 
     orbital_time_in_seconds = (sat.orbital_time_in_minutes * 60.0)
 
-    if DEBUGGING:
+    debugging = logger.isEnabledFor(logging.DEBUG)
+    if debugging:
         # goes from tle epoch to 12/24 hours in future
-        print('Total Path Interval: ' + total_path_interval)
+        logger.debug('Total Path Interval: %s', total_path_interval)
 
-    lead_or_trail_times = []
+    # the lead and trail times share their intervals, so each boundary is formatted once
+    lead_times = []
+    trail_times = []
 
     for _ in range(number_of_full_orbits + 1):
-        lead_or_trail_times.append({
+        sub_path_end_str = sub_path_interval_end.isoformat()
+        sub_path_interval_str = sub_path_epoch_str + '/' + sub_path_end_str
+
+        lead_times.append({
             "interval": sub_path_interval_str,
-            "epoch": sub_path_interval_start.isoformat(),
+            "epoch": sub_path_epoch_str,
             "number": [
                 0, orbital_time_in_seconds,
                 orbital_time_in_seconds, 0
             ]
         })
-
-        if DEBUGGING:
-            print('Sub interval string: ' + sub_path_interval_str)
-
-        sub_path_interval_start = sub_path_interval_end
-        sub_path_interval_end = (sub_path_interval_start +
-                                 timedelta(minutes=sat.orbital_time_in_minutes))
-        sub_path_interval_str = (sub_path_interval_start.isoformat() + '/' +
-                                 sub_path_interval_end.isoformat())
-
-    path.leadTime = lead_or_trail_times
-
-    if DEBUGGING:
-        print()
-
-    sub_path_interval_start = parser.parse(start_epoch_str)
-    # first interval roughly half an orbit, rest of the path intervals are full orbits
-    sub_path_interval_end = sub_path_interval_start + timedelta(minutes=left_over_minutes)
-    sub_path_interval_str = (sub_path_interval_start.isoformat() + '/' +
-                             sub_path_interval_end.isoformat())
-
-    lead_or_trail_times = []
-
-    for _ in range(number_of_full_orbits + 1):
-        lead_or_trail_times.append({
+        trail_times.append({
             "interval": sub_path_interval_str,
-            "epoch": sub_path_interval_start.isoformat(),
+            "epoch": sub_path_epoch_str,
             "number":[
                 0, 0,
                 orbital_time_in_seconds, orbital_time_in_seconds
             ]
         })
 
-        if DEBUGGING:
-            print('Sub interval string: ' + sub_path_interval_str)
+        if debugging:
+            logger.debug('Sub interval string: %s', sub_path_interval_str)
 
         sub_path_interval_start = sub_path_interval_end
+        sub_path_epoch_str = sub_path_end_str
         sub_path_interval_end = (sub_path_interval_start +
                                  timedelta(minutes=sat.orbital_time_in_minutes))
 
-        sub_path_interval_str = (sub_path_interval_start.isoformat() + '/' +
-                                 sub_path_interval_end.isoformat())
-
-    path.trailTime = lead_or_trail_times
+    path.leadTime = lead_times
+    path.trailTime = trail_times
 
     return path
 
-def create_position(start_time, end_time, tle):
-    'creates a position'
+
+def create_sampled_lead_trail_times(epoch, sat, sim_start_time, sim_end_time):
+    '''
+    returns the lead and trail time of a path as sampled numbers in seconds since epoch,
+    following the same orbit intervals as create_path, a lead time counting down from a whole
+    orbit to zero over every interval and a trail time counting up, the jump back at the end
+    of an interval happens over PATH_SAMPLE_GAP seconds as samples cannot share a time
+    '''
+    orbital_time_in_seconds = sat.orbital_time_in_minutes * 60.0
+    minutes_in_sim = int((sim_end_time - sim_start_time).total_seconds()/60)
+    number_of_full_orbits = math.floor(minutes_in_sim/sat.orbital_time_in_minutes)
+
+    # first interval roughly half an orbit, rest of the path intervals are full orbits
+    interval_start = 0.0
+    interval_end = (minutes_in_sim % sat.orbital_time_in_minutes) * 60.0
+
+    lead_times = []
+    trail_times = []
+    for _ in range(number_of_full_orbits + 1):
+        last_time = max(interval_end - PATH_SAMPLE_GAP, interval_start)
+        elapsed = last_time - interval_start
+        lead_times.extend((interval_start, orbital_time_in_seconds,
+                           last_time, orbital_time_in_seconds - elapsed))
+        trail_times.extend((interval_start, 0, last_time, elapsed))
+
+        interval_start = interval_end
+        interval_end = interval_start + orbital_time_in_seconds
+
+    return {"epoch": epoch, "number": lead_times}, {"epoch": epoch, "number": trail_times}
+
+def create_position(start_time, end_time, tle, positions=None, precision=None,
+                    time_step=TIME_STEP, cache=None, stats=None, frame=INERTIAL):
+    '''
+    creates a position, tle can either be a Satellite or an sgp4 object,
+    Satellites are propagated in one batch when numpy and sgp4>=2.0 are available,
+    unless already propagated positions are passed in or found in the EphemerisCache,
+    if precision is given the time offsets and coordinates are rounded to that many decimals,
+    time_step is the number of seconds between samples or a function of the Satellite
+    returning it, frame 'FIXED' writes earth fixed cartesians and 'cartographicDegrees'
+    longitudes, latitudes and heights instead of the INERTIAL ones, see convert_frame
+    '''
     pos = Position()
     pos.interpolationAlgorithm = "LAGRANGE"
     pos.interpolationDegree = 5
-    pos.referenceFrame = "INERTIAL"
-    pos.epoch = start_time.isoformat()
+    pos.referenceFrame = "INERTIAL" if frame == INERTIAL else "FIXED"
+    pos.epoch = get_time_context(start_time, end_time).start_iso
+
+    if positions is None:
+        with measure(stats, 'propagate'):
+            positions = get_positions(tle, start_time, end_time, time_step, cache)
+
+    if frame != INERTIAL:
+        # rounds degrees to more decimals than metres
+        positions = convert_frame(positions, start_time, frame, precision)
+    elif precision is not None:
+        positions = round_positions(positions, precision)
+
+    if frame == CARTOGRAPHIC_DEGREES:
+        pos.cartographicDegrees = positions
+    else:
+        pos.cartesian = positions
+    return pos
+
 
+def get_positions(tle, start_time, end_time, time_step=TIME_STEP, cache=None):
+    '''
+    returns the positions of a Satellite or sgp4 object as a flat float buffer laid out as
+    [t, x, y, z, ...], a Satellite's positions are looked up in the cache before propagating
+    '''
+    time_step = get_time_step(tle, time_step)
+
+    cache_key = None
+    if cache is not None and isinstance(tle, Satellite):
+        cache_key = cache.get_key(tle.raw_tle, start_time, end_time, time_step)
+        positions = cache.get(cache_key)
+        if positions is not None:
+            return positions
+
+    times = get_time_context(start_time, end_time)
+    number_of_positions = times.get_number_of_positions(time_step)
+    positions = propagate_positions(tle, number_of_positions, start_time, time_step)
+
+    if cache_key is not None:
+        cache.put(cache_key, positions)
+    return positions
+
+
+def propagate_positions(tle, number_of_positions, start_time, time_step=TIME_STEP):
+    '''
+    propagates a Satellite or sgp4 object to number_of_positions times time_step seconds apart,
+    returning a flat float buffer laid out as [t, x, y, z, ...]
+    '''
+    # positions are kept in flat float buffers, which Position serializes
+    # without creating an object per sample
+    if isinstance(tle, Satellite) and tle.satrec is not None and np is not None:
+        return get_future_sat_positions_array(
+            tle.satrec, number_of_positions, start_time, time_step)
+
+    sgp4_object = tle.tle_object if isinstance(tle, Satellite) else tle
+    return array('d', get_future_sat_positions(
+        sgp4_object, number_of_positions, start_time, time_step))
+
+
+def round_positions(positions, precision):
+    '''
+    rounds a flat buffer of positions to precision decimals, e.g. 3 for millimetres,
+    so that far fewer digits are written for each coordinate
+    '''
+    if isinstance(positions, array):
+        return array('d', [round(position, precision) for position in positions])
+    return positions.round(precision)
+
+
+def get_time_step(sat, time_step=TIME_STEP):
+    '''
+    returns the seconds between samples for a satellite, time_step can be a number of seconds,
+    a mapping from satellite names or NORAD ids to seconds, where missing satellites get
+    TIME_STEP, or a function taking the Satellite and returning the seconds
+    '''
+    if callable(time_step):
+        return time_step(sat)
+    if isinstance(time_step, Mapping):
+        if isinstance(sat, Satellite):
+            if sat.sat_name in time_step:
+                return time_step[sat.sat_name]
+            sat = sat.elements
+        return time_step.get(sat.satnum, TIME_STEP)
+    return time_step
+
+
+def adaptive_time_step(sat, tolerance=None):
+    '''
+    returns the seconds between samples for a satellite from its orbital period, so that
+    every orbit gets about the same number of samples, eccentric orbits get shorter steps as
+    they move fastest at perigee, if tolerance is given the step is halved until the degree 5
+    lagrange interpolation done by cesium stays within tolerance metres of the orbit
+    '''
+    eccentricity = sat.elements.ecco
+    # mean motion over the angular velocity at perigee
+    perigee_factor = (1 - eccentricity) ** 1.5 / (1 + eccentricity) ** 0.5
+    time_step = (sat.orbital_time_in_minutes * 60 / ADAPTIVE_SAMPLES_PER_ORBIT) * perigee_factor
+    time_step = int(min(max(time_step, MIN_TIME_STEP), MAX_TIME_STEP))
+
+    if tolerance is not None:
+        while (time_step > MIN_TIME_STEP and
+               get_interpolation_error(sat, time_step) > tolerance):
+            time_step = max(time_step // 2, MIN_TIME_STEP)
+
+    return time_step
+
+
+def get_interpolation_error(sat, time_step):
+    '''
+    returns the largest distance in metres over one orbit, starting at the tle epoch,
+    between the orbit and the degree 5 lagrange interpolation of samples time_step
+    seconds apart, checked halfway between the two middle samples of every 6 samples
+    '''
+    number_of_samples = int(math.ceil(sat.orbital_time_in_minutes * 60 / time_step)) + 6
+    samples = propagate_since_epoch(
+        sat, [i * time_step for i in range(number_of_samples)])
+    expected = propagate_since_epoch(
+        sat, [(i + 2.5) * time_step for i in range(number_of_samples - 5)])
+
+    error = 0
+    for i, position in enumerate(expected):
+        interpolated = [sum(weight * sample[axis] for weight, sample
+                            in zip(LAGRANGE_MIDPOINT_WEIGHTS, samples[i:i + 6]))
+                        for axis in range(3)]
+        error = max(error, math.dist(interpolated, position))
+
+    return error * 1000  # converts km's to m's
+
+
+def propagate_since_epoch(sat, seconds_since_epoch):
+    'returns the positions in km of a satellite at a list of seconds after its tle epoch'
+    if sat.satrec is not None and np is not None:
+        satrec = sat.satrec
+        seconds = np.array(seconds_since_epoch, dtype=np.float64)
+        _, eci_positions, _ = satrec.sgp4_array(
+            np.full(len(seconds), satrec.jdsatepoch),
+            satrec.jdsatepochF + seconds / SECONDS_IN_DAY)
+        return eci_positions.tolist()
+
+    return [sgp4_propagate(sat.tle_object, seconds / 60.0)[0]
+            for seconds in seconds_since_epoch]
+
+
+def _lagrange_weights(x, number_of_points):
+    'returns the lagrange basis polynomials for points 0, 1, 2, ... evaluated at x'
+    weights = []
+    for i in range(number_of_points):
+        weight = 1.0
+        for j in range(number_of_points):
+            if i != j:
+                weight *= (x - j) / (i - j)
+        weights.append(weight)
+    return weights
+
+
+LAGRANGE_MIDPOINT_WEIGHTS = _lagrange_weights(2.5, 6)
+
+
+def get_number_of_positions(start_time, end_time, time_step=TIME_STEP):
+    'returns the number of positions to propagate between start_time and end_time'
     diff = end_time - start_time
-    number_of_positions = int(diff.total_seconds()/300)
+    number_of_positions = int(diff.total_seconds()/time_step)
     # so that there's more than one position
-    number_of_positions += 5
-    pos.cartesian = get_future_sat_positions(
-        tle, number_of_positions, start_time)
-    return pos
+    return number_of_positions + 5
 
 
 def get_interval(current_time, end_time):
@@ -243,8 +562,56 @@ def get_interval(current_time, end_time):
     return current_time.isoformat() + "/" + end_time.isoformat()
 
 
-def get_future_sat_positions(sat_tle, number_of_positions, start_time):
+class TimeContext:
+    '''
+    The times of a conversion window, its datetimes, ISO strings and interval are worked out
+    once and shared by every satellite packet, see get_time_context
+    '''
+
+    def __init__(self, start_time, end_time):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.start_iso = start_time.isoformat()
+        self.end_iso = end_time.isoformat()
+        self.interval = self.start_iso + "/" + self.end_iso
+        self.seconds = (end_time - start_time).total_seconds()
+        self._number_of_positions = {}
+
+    def get_number_of_positions(self, time_step=TIME_STEP):
+        'returns the number of positions to propagate over the window, see get_number_of_positions'
+        number_of_positions = self._number_of_positions.get(time_step)
+        if number_of_positions is None:
+            number_of_positions = get_number_of_positions(
+                self.start_time, self.end_time, time_step)
+            self._number_of_positions[time_step] = number_of_positions
+        return number_of_positions
+
+    def get_sample_times(self, time_step=TIME_STEP):
+        '''
+        returns the sample time offsets of the window in seconds and their two part julian
+        dates, see get_sample_times
+        '''
+        return get_sample_times(self.get_number_of_positions(time_step), self.start_time,
+                                time_step)
+
+
+def get_time_context(start_time, end_time):
+    'returns the TimeContext of a window, the same one for every packet of a conversion'
+    # equal aware datetimes in different timezones format differently,
+    # so the offsets are part of the key
+    return _get_time_context(start_time, start_time.utcoffset(), end_time, end_time.utcoffset())
+
+
+@lru_cache(maxsize=TIME_CONTEXT_CACHE_SIZE)
+def _get_time_context(start_time, start_offset, end_time, end_offset):
+    return TimeContext(start_time, end_time)
+
+
+def get_future_sat_positions(sat_tle, number_of_positions, start_time, step=TIME_STEP):
     'returns an array of satellite positions'
+    if start_time.tzinfo is not None:
+        # sgp4 takes the fields of a UTC time
+        start_time = start_time.astimezone(timezone.utc)
     time_step = 0
     output = []
     for _ in range(number_of_positions):
@@ -257,91 +624,401 @@ def get_future_sat_positions(sat_tle, number_of_positions, start_time):
         output.append(eci_position[0] * 1000)  # converts km's to m's
         output.append(eci_position[1] * 1000)
         output.append(eci_position[2] * 1000)
-        time_step += TIME_STEP
+        time_step += step
 
     return output
 
 
+def get_future_sat_positions_array(satrec, number_of_positions, start_time,
+                                   time_step=TIME_STEP):
+    '''
+    returns the satellite positions as a flat float64 array laid out as [t, x, y, z, ...],
+    all sample times are propagated in a single call to Satrec.sgp4_array
+    '''
+    time_steps, jd, fr = get_sample_times(number_of_positions, start_time, time_step)
+    _, eci_positions, _ = satrec.sgp4_array(jd, fr)
+
+    output = np.empty((number_of_positions, 4), dtype=np.float64)
+    output[:, 0] = time_steps
+    output[:, 1:] = eci_positions * 1000  # converts km's to m's
+    return output.ravel()
+
+
+def get_sample_times(number_of_positions, start_time, time_step=TIME_STEP):
+    '''
+    returns the sample time offsets in seconds and their two part julian dates, the grid
+    is computed once per window and step and shared, so the arrays are read only
+    '''
+    if start_time.tzinfo is not None:
+        # the julian dates are worked out from the fields of a UTC time
+        start_time = start_time.astimezone(timezone.utc)
+    return _get_sample_times(number_of_positions, start_time, time_step)
+
+
+@lru_cache(maxsize=SAMPLE_TIMES_CACHE_SIZE)
+def _get_sample_times(number_of_positions, start_time, time_step):
+    time_steps = np.arange(number_of_positions, dtype=np.float64) * time_step
+
+    # same whole second resolution as get_future_sat_positions
+    jd, fr = jday(start_time.year, start_time.month, start_time.day,
+                  start_time.hour, start_time.minute, start_time.second)
+    sample_times = (time_steps, np.full(number_of_positions, jd),
+                    fr + time_steps / SECONDS_IN_DAY)
+    for times in sample_times:
+        times.flags.writeable = False
+    return sample_times
+
+
+def propagate_catalog(satellites, start_time, end_time, chunk_size=CATALOG_CHUNK_SIZE,
+                      time_step=TIME_STEP, cache=None, stats=None):
+    '''
+    propagates a whole catalog through SatrecArray, chunk_size satellites at a time,
+    yields each satellite with its slice of the chunk's (satellites x times) position
+    matrix, laid out as a flat [t, x, y, z, ...] array, if time_step is a function of
+    the satellite, satellites with the same step are propagated together, satellites
+    found in the cache are not propagated
+    '''
+    chunk = []
+    for sat in satellites:
+        chunk.append(sat)
+        if len(chunk) == chunk_size:
+            with measure(stats, 'propagate', len(chunk)):
+                propagated = _propagate_chunk(chunk, start_time, end_time, time_step, cache)
+            yield from propagated
+            chunk = []
+
+    if chunk:
+        with measure(stats, 'propagate', len(chunk)):
+            propagated = _propagate_chunk(chunk, start_time, end_time, time_step, cache)
+        yield from propagated
+
+
+def _propagate_chunk(satellites, start_time, end_time, time_step, cache=None):
+    'propagates a chunk of satellites, one call per distinct step, in the chunk\'s order'
+    chunk_positions = [None] * len(satellites)
+    cache_keys = {}
+    steps = {}
+    for index, sat in enumerate(satellites):
+        step = get_time_step(sat, time_step)
+        if cache is not None:
+            cache_keys[index] = cache.get_key(sat.raw_tle, start_time, end_time, step)
+            chunk_positions[index] = cache.get(cache_keys[index])
+            if chunk_positions[index] is not None:
+                continue
+        steps.setdefault(step, []).append(index)
+
+    times = get_time_context(start_time, end_time)
+    for step, indexes in steps.items():
+        number_of_positions = times.get_number_of_positions(step)
+        time_steps, jd, fr = times.get_sample_times(step)
+        _, eci_positions, _ = SatrecArray(
+            [satellites[index].satrec for index in indexes]).sgp4(jd, fr)
+
+        output = np.empty((len(indexes), number_of_positions, 4), dtype=np.float64)
+        output[:, :, 0] = time_steps
+        output[:, :, 1:] = eci_positions * 1000  # converts km's to m's
+
+        for index, positions in zip(indexes, output):
+            chunk_positions[index] = positions.ravel()
+            if cache is not None:
+                cache.put(cache_keys[index], chunk_positions[index])
+
+    return zip(satellites, chunk_positions)
+
+
 def get_satellite_orbit(raw_tle, sim_start_time, sim_end_time, czml_file_name):
     'returns orbit of the satellite'
-    tle_sgp4 = twoline2rv(raw_tle[1], raw_tle[2], wgs72)
-
-    sat = Satellite(raw_tle, tle_sgp4, DEFAULT_RGBA)
+    sat = create_satellite(raw_tle, DEFAULT_RGBA)
     doc = create_czml_file(sim_start_time, sim_end_time)
 
-    if DEBUGGING:
-        print()
-        print('Satellite Name: ', sat.get_satellite_name)
-        print('TLE Epoch: ', sat.tle_epoch)
-        print('Orbit time in Minutes: ', sat.orbital_time_in_minutes)
-        print()
+    if logger.isEnabledFor(logging.DEBUG):
+        log_satellite(sat, logging.DEBUG)
 
     sat_packet = create_satellite_packet(sat, sim_start_time, sim_end_time)
     doc.packets.append(sat_packet)
     with open(czml_file_name, 'w') as file:
-        file.write(str(doc))
+        doc.dump(file)
 
 
 def read_tles(tles: str, rgbs):
     'reads tle from string'
+    return list(iter_tles(tles.splitlines(), rgbs))
+
+
+def iter_tles(tles, rgbs):
+    '''
+    reads tles lazily, yielding a Satellite per three lines, tles can be a path,
+    a file object or any iterable of lines
+    '''
+    if isinstance(tles, (str, os.PathLike)):
+        with open(tles, 'r') as tle_src:
+            yield from iter_tles(tle_src, rgbs)
+        return
+
     raw_tle = []
-    sats = []
 
-    i = 1
-    for line in tles.splitlines():
-        raw_tle.append(line)
+    for line in tles:
+        raw_tle.append(line.rstrip('\r\n'))
 
-        if i % 3 == 0:
-            tle_object = twoline2rv(raw_tle[1], raw_tle[2], wgs72)
-            sats.append(Satellite(raw_tle, tle_object, rgbs.get_next_color()))
+        if len(raw_tle) == 3:
+            sat = create_satellite(raw_tle, None)
+            sat.rgba = rgbs.get_color(sat)
+            yield sat
             raw_tle = []
-        i += 1
-
-    return sats
 
 
-def tles_to_czml(tles, start_time=None, end_time=None, silent=False):
+def tles_to_czml(tles, start_time=None, end_time=None, silent=False, chunk_size=None,
+                 workers=None, precision=None, time_step=None, adaptive_sampling=False,
+                 sampling_tolerance=None, cache=None, path_style=None, stats=None,
+                 progress=None, colors=None, frame=INERTIAL, shared_billboard=False):
     """
-    Converts the contents of a TLE file to CZML and returns the JSON as a string
+    Converts the contents of a TLE file to CZML and returns the JSON as a string,
+    tles can be the contents as a string, an open TLE file or any iterable of lines,
+    if chunk_size is given the whole catalog is propagated through SatrecArray
+    chunk_size satellites at a time, if workers is greater than 1 the satellite
+    packets are created in a pool of that many processes, if precision is given
+    positions are rounded to that many decimals of a metre, time_step sets the seconds
+    between samples for all satellites, per satellite name or NORAD id in a mapping,
+    or as a function of the Satellite, see get_time_step, adaptive_sampling instead
+    picks each satellite's time step from its orbit, see adaptive_time_step,
+    positions are looked up in cache first if an EphemerisCache is given,
+    path_style 'sampled' or 'constant' writes compact path lead and trail times, see create_path,
+    the time taken by each stage is recorded in stats if a ConversionStats is given,
+    progress is called with the satellites done, their total and the satellites per second,
+    unless silent the details of each satellite are logged at the INFO level, colors is a
+    palette or a function of the NORAD id the satellites are colored with, see Colors,
+    frame 'FIXED' or 'cartographicDegrees' writes earth fixed positions, see create_position,
+    shared_billboard writes the billboard image once in a template packet that every
+    satellite references, instead of in every satellite packet
     """
-    rgbs = Colors()
-    satellite_array = read_tles(tles, rgbs)
+    time_step = get_sampling_time_step(time_step, adaptive_sampling, sampling_tolerance)
+    doc = create_czml_document(tles, start_time, end_time, silent, chunk_size, workers,
+                               progress, colors, precision=precision, time_step=time_step,
+                               cache=cache, path_style=path_style, stats=stats, frame=frame,
+                               shared_billboard=shared_billboard)
+    return str(doc)
 
-    if not start_time:
-        start_time = datetime.utcnow().replace(tzinfo=pytz.UTC)
 
-    if not end_time:
-        end_time = start_time + timedelta(hours=24)
+def write_czml(file, tles, start_time=None, end_time=None, silent=False, chunk_size=None,
+               workers=None, precision=None, time_step=None, adaptive_sampling=False,
+               sampling_tolerance=None, cache=None, path_style=None, stats=None,
+               progress=None, colors=None, frame=INERTIAL, shared_billboard=False):
+    """
+    Converts the contents of a TLE file to CZML and writes it to the file object,
+    each satellite packet is written as soon as it is created, so memory use does not
+    grow with the number of satellites
+    """
+    time_step = get_sampling_time_step(time_step, adaptive_sampling, sampling_tolerance)
+    doc = create_czml_document(tles, start_time, end_time, silent, chunk_size, workers,
+                               progress, colors, precision=precision, time_step=time_step,
+                               cache=cache, path_style=path_style, stats=stats, frame=frame,
+                               shared_billboard=shared_billboard)
+    if stats is not None:
+        file = MeasuredWriter(file, stats)
+    doc.dump(file)
+
+
+def get_sampling_time_step(time_step=None, adaptive_sampling=False, sampling_tolerance=None):
+    '''
+    returns the time_step for create_satellite_packet, a time_step that is given wins over
+    adaptive_sampling, when there are workers mappings and functions must be picklable
+    '''
+    if time_step is not None:
+        return time_step
+    if adaptive_sampling:
+        return partial(adaptive_time_step, tolerance=sampling_tolerance)
+    return TIME_STEP
+
+
+def create_czml_document(tles, start_time=None, end_time=None, silent=False, chunk_size=None,
+                         workers=None, progress=None, colors=None, **packet_options):
+    """
+    Returns a CZML doc for the contents of a TLE file, its satellite packets are only
+    created while the doc is being serialized, so it can only be serialized once,
+    the TLEs are read as the packets are created, packet_options are passed on to
+    create_satellite_packet, progress is called as the packets are created, see
+    report_progress, colors is the palette of the satellites, see Colors
+    """
+    if isinstance(tles, str):
+        tles = tles.splitlines()
 
-    doc = create_czml_file(start_time, end_time)
+    rgbs = Colors(colors)
+    satellite_array = measure_iterable(iter_tles(tles, rgbs), packet_options.get('stats'), 'parse')
+    start_time, end_time = get_time_window(start_time, end_time)
 
-    for sat in satellite_array:
-        sat_name = sat.sat_name
-        orbit_time_in_minutes = sat.orbital_time_in_minutes
-        tle_epoch = sat.tle_epoch
+    doc = create_czml_file(start_time, end_time, packet_options.get('shared_billboard', False))
 
-        if not silent:
-            print()
-            print('Satellite Name: ', sat_name)
-            print('TLE Epoch: ', tle_epoch)
-            print('Orbit time in Minutes: ', orbit_time_in_minutes)
-            print()
+    if workers and workers > 1:
+        sat_packets = create_satellite_packets_parallel(
+            satellite_array, start_time, end_time, workers, chunk_size, silent,
+            **packet_options)
+    else:
+        sat_packets = create_satellite_packets(
+            satellite_array, start_time, end_time, chunk_size, silent, **packet_options)
 
-        sat_packet = create_satellite_packet(sat, start_time, end_time)
+    if progress is not None:
+        # a TLE is three lines, the number of satellites is only known for lists of lines
+        total = len(tles) // 3 if isinstance(tles, Sequence) else None
+        sat_packets = report_progress(sat_packets, progress, total)
 
-        doc.packets.append(sat_packet)
+    doc.packets = chain(doc.packets, sat_packets)
+    return doc
 
-    return str(doc)
 
+def get_time_window(start_time=None, end_time=None):
+    'returns the start and end time, which default to now and 24 hours after the start'
+    if not start_time:
+        start_time = datetime.now(timezone.utc)
+
+    if not end_time:
+        end_time = start_time + timedelta(hours=24)
 
-def create_czml(inputfile_path, outputfile_path=None, start_time=None, end_time=None):
+    return start_time, end_time
+
+
+def create_satellite_packets(satellites, start_time, end_time, chunk_size=None, silent=True,
+                             **packet_options):
+    '''
+    yields the packet of each satellite, propagating them in chunks if chunk_size is given,
+    packet_options are passed on to create_satellite_packet, with a ConversionStats as the
+    stats option the packets are yielded already serialized, so serializing is measured too
+    '''
+    stats = packet_options.get('stats')
+    if chunk_size and Satrec is not None:
+        propagated = propagate_catalog(satellites, start_time, end_time, chunk_size,
+                                       packet_options.get('time_step', TIME_STEP),
+                                       packet_options.get('cache'), stats)
+    else:
+        propagated = ((sat, None) for sat in satellites)
+
+    # checked once, so satellites are not logged one by one when nobody listens
+    log_satellites = not silent and logger.isEnabledFor(logging.INFO)
+    for sat, positions in propagated:
+        if log_satellites:
+            log_satellite(sat)
+
+        sat_packet = create_satellite_packet(sat, start_time, end_time, positions, **packet_options)
+        if stats is not None:
+            with stats.measure('serialize'):
+                sat_packet = SerializedPacket(sat_packet.dumps())
+        yield sat_packet
+
+
+def create_satellite_packets_parallel(satellites, start_time, end_time, workers,
+                                      chunk_size=None, silent=True, **packet_options):
+    '''
+    yields the packet of each satellite, already serialized to JSON by a pool of worker
+    processes, packets are yielded in the same order as the satellites, the stats the
+    workers measure are merged into the stats option as their tasks finish
+    '''
+    task_size = chunk_size or WORKER_TASK_SIZE
+    # workers serialize with the same options as this process
+    serializer = get_serializer()
+    # workers measure into their own stats, which are sent back with the packets
+    stats = packet_options.pop('stats', None)
+    packet_options['stats'] = stats is not None
+
+    log_satellites = not silent and logger.isEnabledFor(logging.INFO)
+    # the process pool is only imported when there are workers
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # only keep a couple of tasks per worker in flight, in submission order
+        pending = deque()
+        task = []
+        for sat in satellites:
+            if log_satellites:
+                log_satellite(sat)
+
+            task.append((sat.raw_tle, sat.rgba))
+            if len(task) == task_size:
+                pending.append(executor.submit(
+                    _create_packets_json, task, start_time, end_time, chunk_size, serializer,
+                    packet_options))
+                task = []
+
+            while len(pending) > workers * 2:
+                yield from _serialized_packets(pending.popleft(), stats)
+
+        if task:
+            pending.append(executor.submit(
+                _create_packets_json, task, start_time, end_time, chunk_size, serializer,
+                packet_options))
+
+        while pending:
+            yield from _serialized_packets(pending.popleft(), stats)
+
+
+def _serialized_packets(future, stats=None):
+    'yields the packets returned by a worker, merging its measurements into stats'
+    packets_json, worker_stats = future.result()
+    if stats is not None:
+        stats.merge(worker_stats)
+    for packet_json in packets_json:
+        yield SerializedPacket(packet_json)
+
+
+def _create_packets_json(task, start_time, end_time, chunk_size, serializer, packet_options):
+    '''
+    runs in a worker process, creates the packets of a list of (raw_tle, rgba)
+    and returns them serialized to JSON, with what was measured if the stats option is true
+    '''
+    set_serializer(serializer)
+    packet_options = dict(packet_options)
+    stats = ConversionStats() if packet_options.pop('stats', False) else None
+
+    # kept apart from parse, where this process already measured reading the satellites
+    with measure(stats, 'worker_parse', len(task)):
+        satellites = [create_satellite(raw_tle, rgba) for raw_tle, rgba in task]
+    packets_json = [sat_packet.dumps() for sat_packet in
+                    create_satellite_packets(satellites, start_time, end_time, chunk_size,
+                                             stats=stats, **packet_options)]
+    return packets_json, stats.as_dict() if stats is not None else None
+
+
+def log_satellite(sat, level=logging.INFO):
+    'logs the details of a satellite'
+    logger.log(level, 'Satellite Name: %s, TLE Epoch: %s, Orbit time in Minutes: %s',
+               sat.sat_name, sat.tle_epoch, sat.orbital_time_in_minutes)
+
+
+def report_progress(sat_packets, progress, total=None):
+    '''
+    yields the satellite packets, calling progress with the number of packets done, the
+    total number of satellites, None when it is not known up front, and the packets per
+    second so far, at most every PROGRESS_INTERVAL seconds and once all packets are done
+    '''
+    start = last_report = time.perf_counter()
+    done = 0
+    for sat_packet in sat_packets:
+        yield sat_packet
+        done += 1
+
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            progress(done, total, done / (now - start))
+
+    elapsed = time.perf_counter() - start
+    progress(done, total, done / elapsed if elapsed else 0.0)
+
+
+def create_czml(inputfile_path, outputfile_path=None, start_time=None, end_time=None,
+                chunk_size=None, workers=None, precision=None, time_step=None,
+                adaptive_sampling=False, sampling_tolerance=None, cache=None, path_style=None,
+                stats=None, progress=None, silent=False, colors=None, frame=INERTIAL,
+                shared_billboard=False):
     """
-    Takes in a file of TLE's and returns a CZML file visualising their orbits.
+    Takes in a file of TLE's and returns a CZML file visualising their orbits,
+    see tles_to_czml for the options.
     """
     with open(inputfile_path, 'r') as tle_src:
-        doc = tles_to_czml(
-            tle_src.read(), start_time=start_time, end_time=end_time)
         if not outputfile_path:
             outputfile_path = "orbit.czml"
         with open(outputfile_path, 'w') as file:
-            file.write(str(doc))
+            write_czml(file, tle_src, start_time=start_time, end_time=end_time,
+                       chunk_size=chunk_size, workers=workers, precision=precision,
+                       time_step=time_step, adaptive_sampling=adaptive_sampling,
+                       sampling_tolerance=sampling_tolerance, cache=cache,
+                       path_style=path_style, stats=stats, progress=progress, silent=silent,
+                       colors=colors, frame=frame, shared_billboard=shared_billboard)